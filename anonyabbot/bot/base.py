@@ -1,18 +1,20 @@
 import asyncio
 from dataclasses import dataclass
-from typing import Dict, Tuple, Union, Any, List
-from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple, Union, Any, List
+from datetime import datetime, timedelta
 import hashlib
 
 from appdirs import user_data_dir
+from peewee import Field, Model, Node, Select, Tuple as Row
 from pyrogram import Client, filters
 from pyrogram.filters import Filter
 from pyrogram.types import InputMedia, Message as TM, CallbackQuery as TC
 from pyrogram.enums import ParseMode
 from pyrubrum import (
     ParameterizedHandler,
+    BaseDatabase,
     DictDatabase,
-    RedisDatabase,
+    NotFoundError,
     Element,
     Menu,
     LinkMenu,
@@ -26,7 +28,7 @@ from .. import __product__
 
 from ..utils import to_iterable
 from ..config import config
-from ..cache import Cache
+from ..cache import AsyncCache, Cache
 
 
 @dataclass
@@ -36,6 +38,122 @@ class Conversation:
     data: Any
 
 
+class Paged:
+    """
+    Lazy items of a page menu, which fetches only rows of the visible page.
+    Rows are ordered by the key and then primary key in the same direction. Pages are fetched by keyset
+    from the last row of the previous page, and by offset for pages not reached from the previous one.
+    """
+
+    def __init__(
+        self,
+        query: Select,
+        key: Node,
+        desc: bool,
+        count: int,
+        render: Callable[[int, Model], Tuple[str, str, Any]],
+        attr: str = None,
+    ):
+        self.query = query
+        self.key = key
+        self.desc = desc
+        self.count = count
+        self.render = render
+        self.attr = attr or key.name
+
+    @property
+    def signature(self):
+        return f"{self.attr}.{'desc' if self.desc else 'asc'}"
+
+    def fetch(self, page: int, per_page: int, cursors: Dict[str, list]):
+        """Fetch rendered entries of a page, and save the cursor of the next page in cursors, which are json serializable."""
+        pk = self.query.model._meta.primary_key
+        if self.desc:
+            query = self.query.order_by(self.key.desc(), pk.desc())
+        else:
+            query = self.query.order_by(self.key, pk)
+        cursor = cursors.get(str(page), None)
+        if cursor:
+            if self.desc:
+                query = query.where(Row(self.key, pk) < Row(*cursor))
+            else:
+                query = query.where(Row(self.key, pk) > Row(*cursor))
+        elif page:
+            query = query.offset(page * per_page)
+        rows = list(query.limit(per_page))
+        if rows:
+            last = getattr(rows[-1], self.attr)
+            if isinstance(self.key, Field):
+                last = self.key.db_value(last)
+            if isinstance(last, datetime):
+                last = last.isoformat(" ")
+            cursors[str(page + 1)] = [last, rows[-1]._pk]
+        return [self.render(page * per_page + i + 1, r) for i, r in enumerate(rows)]
+
+    def load(self, menu_id: str, page: int, per_page: int, parameters: Dict[str, Any]):
+        """Fetch rendered entries of a page of a menu, with cursors kept in menu parameters until the sorting changes."""
+        cursors = parameters.get(f"cursor_{menu_id}", None)
+        if not cursors or cursors.get("sort", None) != self.signature:
+            cursors = {"sort": self.signature}
+        entries = self.fetch(page, per_page, cursors)
+        parameters[f"cursor_{menu_id}"] = cursors
+        return entries
+
+
+class PagedItems:
+    """Items of a page menu of which only the visible page is loaded, which are sliced by pyrubrum from the page offset."""
+
+    def __init__(self, count: int, offset: int, elements: List[Element]):
+        self.count = count
+        self.offset = offset
+        self.elements = elements
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.start == self.offset:
+            return self.elements[: key.stop]
+        else:
+            return []
+
+
+class PagedContentMenu(ContentPageMenu):
+    """Content page menu whose content is a list of entries, or a `Paged` of which only the visible page is fetched."""
+
+    async def on_update(self, handler, client: Client, context: Union[TM, TC], parameters: Optional[Dict[str, Any]] = None):
+        element_id = parameters.get("element_id", "")
+        if element_id == "":
+            page = int(parameters.get(f"page_{self.menu_id}", 0))
+        elif parameters.get("same_menu", False):
+            page = int(element_id)
+        else:
+            page = 0
+        content = await self.parse(self.content, handler, client, context, parameters)
+        if content is None:
+            return
+        per_page = self.style.limit_items
+        if isinstance(content, Paged):
+            entries = content.load(self.menu_id, page, per_page, parameters)
+            count = content.count
+        else:
+            entries = content[page * per_page : (page + 1) * per_page]
+            count = len(content)
+        entries = [(await self.parse(c, handler, client, context, parameters), t, x) for c, t, x in entries]
+        text = "\n".join([c for c, t, x in entries])
+        if self.header:
+            text = await self.parse(self.header, handler, client, context, parameters) + "\n" + text
+        if self.footer:
+            text = text + "\n" + await self.parse(self.footer, handler, client, context, parameters)
+        await self.call_preliminary(handler, client, context, parameters)
+        self.items = PagedItems(count, page * per_page, [Element(t, x) for c, t, x in entries])
+        keyboard = await self.keyboard(handler, client, context, parameters)
+        if isinstance(context, TC):
+            await context.edit_message_text(text, reply_markup=keyboard, **self.kwargs)
+        elif isinstance(context, TM):
+            await context.reply_text(text, reply_markup=keyboard, **self.kwargs)
+
+
 class Bot:
     name = None
 
@@ -103,13 +221,46 @@ class Bot:
             raise TypeError("context should be message or callback query.")
 
 
+class MenuDatabase(BaseDatabase):
+    """
+    Menu parameters of pyrubrum, which are read from the local cache and written to redis in the background,
+    so that rendering a menu or handling a click does not wait for redis on the event loop.
+    """
+
+    def __init__(self, default_expire: int = 86400):
+        self.default_expire = default_expire
+        self.tasks = set()
+
+    def spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def get(self, key: str) -> str:
+        content = Cache().get(key, default=None)
+        if content is None:
+            raise NotFoundError(key)
+        return content
+
+    def set(self, key: str, value: str, expire=None):
+        ttl = self.default_expire if expire is None else (expire or None)
+        if isinstance(ttl, timedelta):
+            ttl = int(ttl.total_seconds())
+        Cache.local.set(key, value, ttl=ttl)
+        self.spawn(AsyncCache().set(key, value, ttl=ttl))
+
+    def delete(self, key: str):
+        Cache.local.pop(key)
+        self.spawn(AsyncCache().delete(key))
+
+
 class MenuBot(Bot):
     def __init__(self, *args, **kw) -> None:
         super().__init__(*args, **kw)
         self.conversation: Dict[Tuple[int, int], Conversation] = {}
         redis = Cache.get_redis()
         if redis:
-            db = RedisDatabase(redis)
+            db = MenuDatabase()
         else:
             db = DictDatabase()
         self.menu = ParameterizedHandler(self.tree, db)
@@ -243,7 +394,16 @@ class MenuBot(Bot):
             if not func:
                 raise ValueError(f'menu items function "items_{id.lstrip("_")}" does not exist')
             else:
-                items = func
+
+                async def items(handler, client, context, parameters, func=func):
+                    result = await func(handler, client, context, parameters)
+                    if isinstance(result, Paged):
+                        page = parameters.get(f"page_{id}", 0)
+                        elements = result.load(id, page, per_page, parameters)
+                        return PagedItems(result.count, page * per_page, elements)
+                    else:
+                        return result
+
         else:
             items = [i if isinstance(i, Element) else Element(str(i), str(i)) for i in items]
         menu_params, style_params = self._prepare_params(
@@ -308,7 +468,7 @@ class MenuBot(Bot):
             next_page_text="➡️",
             previous_page_text="⬅️",
         )
-        return ContentPageMenu(**menu_params, header=header, footer=footer, style=style)
+        return PagedContentMenu(**menu_params, header=header, footer=footer, style=style)
 
     def _link(
         self,
@@ -1,18 +1,36 @@
-from datetime import datetime, timedelta
+import csv
+import os
+from datetime import datetime
+from tempfile import NamedTemporaryFile
 from textwrap import indent
 from pyrogram import Client
 from pyrogram.types import CallbackQuery as TC
 from pyrubrum import Element
-from peewee import fn
 
 import anonyabbot
 
 from ...utils import to_iterable, truncate_str
-from ...model import User, UserRole, Group, Member, Message
+from ...config import config
+from ...keyspace import Keyspace
+from ...model import Activity, Counter, User, UserRole, Group, Message
+from ..base import Paged
 from ..pool import start_time, worker_status, stop_group_bot
 from .common import operation
 
 
+def format_trend(trend):
+    bars = "▁▂▃▄▅▆▇█"
+    top = max(c["messages"] for _, c in trend) or 1
+    spark = "".join(bars[c["messages"] * (len(bars) - 1) // top] for _, c in trend)
+    lines = [f"消息: `{spark}`", ""]
+    for start, c in trend:
+        lines.append(
+            f"`{start.strftime('%m-%d')}` 消息 {c['messages']} | 送达 {c['deliveries']} | 错误 {c['errors']} | "
+            f"发言 {c['senders']} | 加入 {c['joins']} | 退出 {c['leaves']}"
+        )
+    return "\n".join(lines)
+
+
 class Admin:
     @operation(UserRole.ADMIN)
     async def on_admin(
@@ -22,15 +40,15 @@ class Admin:
         context: TC,
         parameters: dict,
     ):
-        n_groups = Group.select().where(~(Group.disabled)).count()
-        date_ago = datetime.now() - timedelta(days=7)
-        n_active_groups = Group.select().where(~(Group.disabled), Group.last_activity >= date_ago).count()
+        n_groups = Group.n_groups()
+        n_active_groups = Group.n_active_groups()
         latest_user: User = User.select().order_by(User.created.desc()).get()
         running_time = ":".join(str(datetime.now() - start_time).split(":")[:3]).split('.')[0]
-        waiting_delay = f"{worker_status['time'] / worker_status['requests']:.1f} 秒" if worker_status['requests'] else "无数据"
+        status = await worker_status.all()
+        waiting_delay = f"{status['time'] / status['requests']:.1f} 秒" if status['requests'] else "无数据"
         msg = f"ℹ️ 系统信息:\n\n"
         fields = [
-            f"用户数: {User.select().count()}",
+            f"用户数: {User.n_users()}",
             f"群主数: {User.n_in_role(UserRole.GROUPER)}",
             f"荣誉用户数: {User.n_in_role(UserRole.AWARDED)}",
             f"付费用户数: {User.n_in_role(UserRole.PAYING)}",
@@ -40,11 +58,37 @@ class Admin:
             f"活跃群组数: {n_active_groups}",
             f"运行时间: {running_time}",
             f"平均传播延迟: {waiting_delay}",
-            f"消息数: {Message.select().count()}",
+            f"消息数: {Message.n_messages()}",
         ]
         msg += indent("\n".join(fields), "  ")
         return msg
 
+    @operation(UserRole.ADMIN)
+    async def on_admin_activity(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        msg = f"📈 所有群组最近 14 天活跃趋势:\n\n"
+        msg += indent(format_trend(Activity.trend(days=14)), "  ")
+        return msg
+
+    @operation(UserRole.ADMIN)
+    async def on_admin_keyspace(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        result = await Keyspace.report(batch=config.snapshot.keyspace_batch)
+        tokens = list(result["groups"])
+        names = {g.token: f"@{g.username}" for g in Group.select(Group.token, Group.username).where(Group.token.in_(tokens))}
+        report = truncate_str("\n".join(Keyspace.format(result, names=names)), 3500)
+        return f"🧮 缓存占用:\n\n```\n{report}\n```"
+
     @operation(UserRole.ADMIN)
     async def items_generate_codes_select_role(
         self: "anonyabbot.FatherBot",
@@ -93,10 +137,27 @@ class Admin:
         days = int(parameters["generate_codes_select_num_id"])
         num = int(parameters["generate_codes_id"])
         user: User = context.from_user.get_record()
-        msg = "⭐ 生成的身份码:\n\n"
-        for c in to_iterable(user.create_code(roles, days=days, num=num)):
-            msg += f"`{c}`\n"
-        return msg
+        codes = to_iterable(user.create_code(roles, days=days, num=num))
+        if num <= 20:
+            msg = "⭐ 生成的身份码:\n\n"
+            for c in codes:
+                msg += f"`{c}`\n"
+            return msg
+        role_names = " ".join(r.name for r in roles)
+        with NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as f:
+            writer = csv.writer(f)
+            writer.writerow(["code", "roles", "days"])
+            writer.writerows([c, role_names, days] for c in codes)
+        try:
+            await self.bot.send_document(
+                context.message.chat.id,
+                f.name,
+                file_name=f"codes_{datetime.now():%Y%m%d%H%M%S}.csv",
+                caption=f"⭐ 已生成 {num} 个身份码.",
+            )
+        finally:
+            os.unlink(f.name)
+        return f"⭐ 已生成 {num} 个身份码, 请查看上方文件."
 
     @operation(UserRole.ADMIN)
     async def on_list_group_all(
@@ -107,30 +168,25 @@ class Admin:
         parameters: dict,
     ):
         sorting, desc = parameters.get("lga_sorting", ("members", True))
+        n_groups = Group.select().count()
+        if not n_groups:
+            await self.info("⚠️ 当前没有群组.", context=context)
+            await self.to_menu("admin", context)
+            return []
         if sorting == "activity":
             groups = Group.select()
-            if desc:
-                groups = groups.order_by(Group.last_activity.desc())
-            else:
-                groups = groups.order_by(Group.last_activity)
+            key = Group.last_activity
         else:
-            groups = Group.select(Group, fn.COUNT(Member.id).alias("num_members")).join(Member).group_by(Group.id)
-            if desc:
-                groups = groups.order_by(fn.Count(Member.id).desc())
-            else:
-                groups = groups.order_by(fn.Count(Member.id))
-        items = []
-        g: Group
-        for i, g in enumerate(groups.iterator()):
+            groups = Group.s_with_n_members()
+            key = Counter.value
+
+        def render(i: int, g: Group):
             name = f"[{truncate_str(g.title, 20)}](t.me/{g.username})"
             if g.disabled:
                 name = f"~~{name}~~"
-            item = f"{i+1} | {name}"
-            items.append((item, str(i + 1), g.id))
-        if not items:
-            await self.info("⚠️ 当前没有群组.", context=context)
-            await self.to_menu("admin", context)
-        return items
+            return (f"{i} | {name}", str(i), g.id)
+
+        return Paged(groups, key, desc, n_groups, render, attr=None if sorting == "activity" else "num_members")
 
     @operation(UserRole.ADMIN)
     async def button_lga_switch_activity(
@@ -194,6 +250,55 @@ class Admin:
             await context.answer("🔽 成员数从多到少")
         await self.to_menu("list_group_all", context)
 
+    @operation(UserRole.ADMIN)
+    async def on_lga_search(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        self.set_conversation(context, "lga_search")
+        return "⬇️ 输入要搜索的群组标题或用户名:"
+
+    @operation(UserRole.ADMIN)
+    async def header_lga_search_result(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        return f"🔍 搜索 `{parameters.get('lga_query', '')}` 的结果:\n"
+
+    @operation(UserRole.ADMIN)
+    async def on_lga_search_result(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        items = []
+        g: Group
+        for i, g in enumerate(Group.search(parameters.get("lga_query", ""))):
+            name = f"[{truncate_str(g.title, 20)}](t.me/{g.username})"
+            if g.disabled:
+                name = f"~~{name}~~"
+            items.append((f"{i+1} | {name}", str(i + 1), g.id))
+        return items
+
+    @operation(UserRole.ADMIN)
+    async def on_jump_lga_search_result(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        parameters["group_id"] = int(parameters["jump_lga_search_result_id"])
+        await self.to_menu("_group_detail_admin", context)
+
     @operation(UserRole.ADMIN)
     async def on_jump_group_detail_admin(
         self: "anonyabbot.FatherBot",
@@ -227,6 +332,19 @@ class Admin:
         msg += indent("\n".join(fields), "  ")
         return msg
 
+    @operation(UserRole.ADMIN)
+    async def on_group_activity_admin(
+        self: "anonyabbot.FatherBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        group: Group = Group.get_by_id(parameters["group_id"])
+        msg = f"📈 群组 @{group.username} 最近 14 天活跃趋势:\n\n"
+        msg += indent(format_trend(Activity.trend(group, days=14)), "  ")
+        return msg
+
     @operation(UserRole.ADMIN)
     async def on_admin_delete_group_confirm(
         self: "anonyabbot.FatherBot",
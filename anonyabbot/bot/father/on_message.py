@@ -38,6 +38,12 @@ class OnMessage:
                     else:
                         msg = "⚠️ 无效的角色码"
                     return await info(msg)
+                if conv.status == "lga_search":
+                    query = message.text.strip()
+                    if not Group.search(query, limit=1):
+                        return await info("⚠️ 没有找到匹配的群组")
+                    await self.to_menu_scratch("_lga_search_result", message.chat.id, message.from_user.id, lga_query=query)
+                    return
                 if conv.status == "ng_token":
                     match = re.search(r"[0-9]{8,10}:[a-zA-Z0-9_-]{35}", message.text)
                     if not match:
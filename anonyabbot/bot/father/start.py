@@ -69,7 +69,7 @@ class Start:
     ):
         user: User = context.from_user.get_record()
         code = user.create_code(UserRole.INVITED, length = 8)
-        days = config.get('father.invite_award_days', 180)
+        days = config.snapshot.invite_award_days
         return (
             "🔗 将以下链接复制给您的朋友:\n\n"
             f"`https://t.me/{self.bot.me.username}?start=_c_{code}`\n\n"
@@ -88,7 +88,7 @@ class Start:
             user: User = context.from_user.get_record()
             used = user.use_code(parameters['code'])
             if len(used) == 1 and used[0].role == UserRole.INVITED:
-                days = config.get('father.invite_award_days', 180)
+                days = config.snapshot.invite_award_days
                 msg = (
                     f"🌈 欢迎 {context.from_user.name}!\n\n"
                     "此机器人将帮助您创建一个全匿名群组.\n"
@@ -39,15 +39,20 @@ class Tree:
                     "list_group_all",
                     "⚒️ 管理群组",
                     "ℹ️ 所有群组: ",
-                    extras=["_lga_switch_activity", "_lga_switch_member"],
+                    extras=["_lga_switch_activity", "_lga_switch_member", "_lga_search"],
                 ): {M("jump_group_detail_admin")},
+                M("admin_activity", "📈 活跃趋势"): None,
+                M("admin_keyspace", "🧮 缓存占用"): None,
             },
             K("_generate_codes_select_days", display="ℹ️ 选择时间", items=[30, 60, 90, 180, 360, 1080, 3600]): {
-                K("generate_codes_select_num", display="ℹ️ 选择数量", items=[1, 5, 10, 20]): {M("generate_codes", back="admin")}
+                K("generate_codes_select_num", display="ℹ️ 选择数量", items=[1, 5, 10, 20, 100, 1000, 5000]): {M("generate_codes", back="admin")}
             },
             M("_lga_switch_activity"): None,
             M("_lga_switch_member"): None,
+            M("_lga_search", "🔍 搜索", back="list_group_all"): None,
+            P("_lga_search_result", back="list_group_all"): {M("jump_lga_search_result")},
             M("_group_detail_admin", back="list_group_all"): {
+                M("group_activity_admin", "📈 活跃趋势"): None,
                 M("admin_delete_group_confirm", "🗑️ 删除群组"): {M("admin_delete_group", "⚠️ 是的, 我确定")},
             },
         }
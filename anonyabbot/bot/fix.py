@@ -26,10 +26,14 @@ def patch_pyrogram():
             else:
                 return None
         if ur:
-            ur.username = self.username
-            ur.firstname = self.first_name
-            ur.lastname = self.last_name
-            ur.save()
+            if ur.username != self.username:
+                ur.username = self.username
+            if ur.firstname != self.first_name:
+                ur.firstname = self.first_name
+            if ur.lastname != self.last_name:
+                ur.lastname = self.last_name
+            if ur.is_dirty():
+                ur.save()
             return ur
 
     def get_member(self: TU, group: Group):
@@ -9,11 +9,12 @@ from pyrogram.errors import UserDeactivated, RPCError
 from pyrogram.types import BotCommand
 
 from ...utils import truncate_str
-from ...cache import Cache, CacheDict
+from ...cache import CacheCounter
 from ...config import config
-from ...model import UserRole, db, BanGroup, Group, User, Member, MemberRole
+from ...model import UserRole, db, shard_db, BanGroup, Group, User, Member, MemberRole
 from ..base import MenuBot
 from .mask import UniqueMask
+from .invite import InviteCodes
 from .worker import Worker, WorkerQueue
 from .on_message import OnMessage
 from .command import OnCommand
@@ -37,15 +38,8 @@ class GroupBot(MenuBot, _Methods):
         self.lock = asyncio.Lock()
         self.user_locks: Dict[Member, asyncio.Lock] = {}
         self.queue = WorkerQueue(f'group.{self.token}.worker.queue', self.bot)
-        self.worker_status = CacheDict(
-            f'group.{self.token}.worker.status',
-            default={
-                'time': 0,
-                'requests': 0,
-                'errors': 0
-            }
-        )
-        self.invite_codes = Cache(base=f'group.{self.token}.invite.code')
+        self.worker_status = CacheCounter(f'group.{self.token}.worker.status', fields=('time', 'requests', 'errors'))
+        self.invite_codes = InviteCodes(self.token)
         self.jobs.append(self.worker())
         self.group: Group = Group.get_or_none(token=self.token)
         if self.group:
@@ -57,6 +51,7 @@ class GroupBot(MenuBot, _Methods):
         try:
             try:
                 await self.bot.start()
+                await self.queue.reload(force=False)
                 await self.setup()
             except Exception as e:
                 if isinstance(e, UserDeactivated):
@@ -127,10 +122,12 @@ class GroupBot(MenuBot, _Methods):
                 if not self.creator.validate(UserRole.GROUPER):
                     self.creator.add_role(UserRole.GROUPER)
                 if self.creator.validate(UserRole.INVITED):
-                    days = config.get('father.invite_award_days', 180)
+                    days = config.snapshot.invite_award_days
                     self.creator.add_role(UserRole.AWARDED, days=days)
                     if self.creator.invited_by:
                         self.creator.invited_by.add_role(UserRole.AWARDED, days=days)
+        shard_db.bind(self.group.id)
+        self.unique_mask_pool.configure(self.group.mask_mode, self.group.mask_alphabet)
         logger.info(f"Now listening updates in group: @{self.bot.me.username}.")
 
         await self.bot.set_bot_commands(
@@ -152,7 +149,8 @@ class GroupBot(MenuBot, _Methods):
 
     async def touch(self):
         if self.group:
-            self.group.username = self.bot.me.username
-            self.group.title = self.bot.me.name
-            self.group.save()
+            if self.group.username != self.bot.me.username:
+                self.group.username = self.bot.me.username
+            if self.group.title != self.bot.me.name:
+                self.group.title = self.bot.me.name
             self.group.touch()
\ No newline at end of file
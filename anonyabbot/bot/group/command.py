@@ -8,7 +8,7 @@ from pyrubrum import Element
 
 import anonyabbot
 
-from ...model import MemberRole, Member, OperationError, BanType, Message, PMBan, PMMessage, RedirectedMessage, User
+from ...model import MemberRole, Member, OperationError, BanType, Message, PMBan, PMMessage, User
 from ...utils import async_partial, parse_timedelta
 from .common import operation
 from .worker import DeleteOperation, PinOperation, UnpinOperation
@@ -21,12 +21,10 @@ class OnCommand:
         rm = message.reply_to_message
         if not rm:
             raise OperationError("没有回复消息")
-        mr: Message = Message.get_or_none(mid=rm.id, member=member)
+        mr: Message = Message.get_or_none(group=self.group, member=member, mid=rm.id)
         if not mr:
-            rmr = RedirectedMessage.get_or_none(mid=rm.id, to_member=member)
-            if rmr:
-                mr: Message = rmr.message
-            else:
+            mr: Message = Message.from_redirect(member, rm.id)
+            if not mr:
                 if allow_pm:
                     pmm: PMMessage = PMMessage.get_or_none(redirected_mid=rm.id, to_member=member)
                     if pmm:
@@ -418,7 +416,7 @@ class OnCommand:
         digits = [s for s in string.digits if not s == "0"]
         asciis = [s for s in string.ascii_uppercase if not s == "O"]
         code = "".join(random.choices(digits + asciis, k=16))
-        self.invite_codes.set(code, (member, times), ttl=ttl)
+        await self.invite_codes.create(code, member.id, times, ttl=ttl)
         return (
             "🔗 将该邀请链接复制给您的朋友:\n\n"
             f"`https://t.me/{self.bot.me.username}?start=_c_{code}`\n\n"
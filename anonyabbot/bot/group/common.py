@@ -8,77 +8,78 @@ from pyrogram.errors import UserDeactivated, MessageNotModified
 
 import anonyabbot
 from ...utils import nonblocking
-from ...model import OperationError, MemberRole, Member, User
+from ...model import OperationError, MemberRole, Member, User, shard_db
 
 
 def operation(req: MemberRole = MemberRole.GUEST, conversation=False, allow_disabled=False, touch=True, concurrency='inf'):
     def deco(func):
         async def wrapper(*args, **kw):
-            try:
-                self: "anonyabbot.GroupBot"
-                context: Union[TM, TC]
-                client: Client
-                if len(args) == 5:
-                    self, handler, client, context, parameters = args  # from menu
-                elif len(args) == 3:
-                    self, client, context = args  # from message
-                
-                else:
-                    raise ValueError("wrong number of arguments")
+            with shard_db.using(args[0].group.id if args[0].group else None):
                 try:
-                    if touch:
-                        await self.touch()
-                    if not conversation:
-                        self.set_conversation(context, status=None)
-                    if (not allow_disabled) and self.group.disabled:
-                        raise OperationError("此群组已被删除, 无法进行操作")
-                    if req:
-                        member: Member = context.from_user.get_member(self.group)
-                        if not member:
-                            raise OperationError("您不在此群组中")
-                        member.validate(req, fail=True)
-                        member.touch()
-                    if not concurrency == 'inf':
-                        user: User = context.from_user.get_record()
-                        async with self.lock:
-                            if not user in self.user_locks:
-                                self.user_locks[user] = asyncio.Lock()
-                        if concurrency == 'queue':
-                            async with self.user_locks[user]:
-                                return await func(*args, **kw)
-                        elif concurrency == 'singleton':
-                            async with nonblocking(self.user_locks[user]) as locked:
-                                if locked:
-                                    return await func(*args, **kw)
-                        else:
-                            raise ValueError(f'{concurrency} is not a valid concurrency')
+                    self: "anonyabbot.GroupBot"
+                    context: Union[TM, TC]
+                    client: Client
+                    if len(args) == 5:
+                        self, handler, client, context, parameters = args  # from menu
+                    elif len(args) == 3:
+                        self, client, context = args  # from message
+                
                     else:
-                        return await func(*args, **kw)
-                except ContinuePropagation:
-                    raise
-                except OperationError as e:
+                        raise ValueError("wrong number of arguments")
                     try:
-                        await self.info(f"⚠️ 失败: {e}.", context, alert=True)
-                        if isinstance(context, TM):
-                            await context.delete()
-                    except:
-                        pass
-                except MessageNotModified:
-                    pass
-                except Exception as e:
-                    if isinstance(e, ContinuePropagation):
+                        if touch:
+                            await self.touch()
+                        if not conversation:
+                            self.set_conversation(context, status=None)
+                        if (not allow_disabled) and self.group.disabled:
+                            raise OperationError("此群组已被删除, 无法进行操作")
+                        if req:
+                            member: Member = context.from_user.get_member(self.group)
+                            if not member:
+                                raise OperationError("您不在此群组中")
+                            member.validate(req, fail=True)
+                            member.touch()
+                        if not concurrency == 'inf':
+                            user: User = context.from_user.get_record()
+                            async with self.lock:
+                                if not user in self.user_locks:
+                                    self.user_locks[user] = asyncio.Lock()
+                            if concurrency == 'queue':
+                                async with self.user_locks[user]:
+                                    return await func(*args, **kw)
+                            elif concurrency == 'singleton':
+                                async with nonblocking(self.user_locks[user]) as locked:
+                                    if locked:
+                                        return await func(*args, **kw)
+                            else:
+                                raise ValueError(f'{concurrency} is not a valid concurrency')
+                        else:
+                            return await func(*args, **kw)
+                    except ContinuePropagation:
                         raise
-                    logger.opt(exception=e).warning("Callback error:")
-                    try:
-                        await self.info(f"⚠️ 发生错误.", context, alert=True)
-                    except:
+                    except OperationError as e:
+                        try:
+                            await self.info(f"⚠️ 失败: {e}.", context, alert=True)
+                            if isinstance(context, TM):
+                                await context.delete()
+                        except:
+                            pass
+                    except MessageNotModified:
                         pass
-            except UserDeactivated as e:
-                if self.group:
-                    self.group.disabled = True
-                    self.group.save()
-                self.failed.set()
-                logger.info(f"Group @{client.me.username} disabled because token deactivated.")
+                    except Exception as e:
+                        if isinstance(e, ContinuePropagation):
+                            raise
+                        logger.opt(exception=e).warning("Callback error:")
+                        try:
+                            await self.info(f"⚠️ 发生错误.", context, alert=True)
+                        except:
+                            pass
+                except UserDeactivated as e:
+                    if self.group:
+                        self.group.disabled = True
+                        self.group.save()
+                    self.failed.set()
+                    logger.info(f"Group @{client.me.username} disabled because token deactivated.")
 
         return wrapper
 
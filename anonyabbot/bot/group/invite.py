@@ -0,0 +1,86 @@
+from typing import Optional
+
+import redis
+
+from ...cache import AsyncCache, Cache
+
+
+class InviteCodes:
+    """
+    Invite codes of a group, each is a redis hash of the invitor member id and the remaining usage (-1 for unlimited).
+    Codes are redeemed atomically with a script, or with a watched transaction where scripting is not available.
+    """
+
+    redeem_script = """
+    local usage = redis.call('HGET', KEYS[1], 'usage')
+    if not usage then return false end
+    usage = tonumber(usage)
+    if usage == 0 then return false end
+    if usage > 0 then redis.call('HINCRBY', KEYS[1], 'usage', -1) end
+    return redis.call('HGET', KEYS[1], 'invitor')
+    """
+
+    scripting = True
+
+    def __init__(self, token: str):
+        self.base = f"group.{token}.invite.code"
+        self._redeem = None
+
+    def key(self, code: str):
+        return f"{self.base}.{code}"
+
+    async def create(self, code: str, invitor_id: int, times: float, ttl: int = None):
+        usage = -1 if times == float("inf") else int(times)
+        async with Cache.async_client().pipeline(transaction=True) as pipe:
+            pipe.hset(self.key(code), mapping={"invitor": invitor_id, "usage": usage})
+            if ttl:
+                pipe.expire(self.key(code), ttl)
+            await pipe.execute()
+
+    async def invitor(self, code: str) -> Optional[int]:
+        """Get the invitor member id of a code which is not used up, without redeeming it."""
+        await self.upgrade(code)
+        invitor, usage = await Cache.async_client().hmget(self.key(code), "invitor", "usage")
+        if invitor is None or int(usage) == 0:
+            return None
+        return int(invitor)
+
+    async def redeem(self, code: str) -> Optional[int]:
+        """Use the code once and return the invitor member id, or None if the code is invalid or used up."""
+        await self.upgrade(code)
+        client = Cache.async_client()
+        if InviteCodes.scripting:
+            if not self._redeem:
+                self._redeem = client.register_script(self.redeem_script)
+            try:
+                invitor = await self._redeem(keys=[self.key(code)])
+            except redis.ResponseError as e:
+                if "unknown command" not in str(e):
+                    raise
+                InviteCodes.scripting = False
+            else:
+                return int(invitor) if invitor is not None else None
+        async with client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(self.key(code))
+                    invitor, usage = await pipe.hmget(self.key(code), "invitor", "usage")
+                    if invitor is None or int(usage) == 0:
+                        return None
+                    pipe.multi()
+                    if int(usage) > 0:
+                        pipe.hincrby(self.key(code), "usage", -1)
+                    await pipe.execute()
+                    return int(invitor)
+                except redis.WatchError:
+                    continue
+
+    async def upgrade(self, code: str):
+        """Convert a code saved as a pickled (invitor, usage) tuple by older versions into a hash."""
+        client = Cache.async_client()
+        if await client.type(self.key(code)) != b"string":
+            return
+        invitor, usage = await AsyncCache(self.base).get(code)
+        ttl = await client.ttl(self.key(code))
+        await client.delete(self.key(code))
+        await self.create(code, getattr(invitor, "id", invitor), usage, ttl=ttl if ttl > 0 else None)
@@ -1,6 +1,7 @@
 import asyncio
 from datetime import datetime
 from textwrap import indent
+from typing import List
 from pyrogram import Client
 from pyrogram.types import CallbackQuery as TC
 from pyrubrum import Element
@@ -8,7 +9,8 @@ from pyrubrum import Element
 import anonyabbot
 
 from ...utils import async_partial, truncate_str, parse_timedelta
-from ...model import Member, db, MemberRole, BanType, BanGroup
+from ...model import Member, User, db, MemberRole, BanType, BanGroup
+from ..base import Paged
 from .common import operation
 
 
@@ -38,7 +40,8 @@ class Manage:
         group = self.group
         member: Member = context.from_user.get_member(self.group)
         creator = group.creator.markdown if member.role >= MemberRole.ADMIN_BAN else group.creator.masked_name
-        waiting_delay = f"{self.worker_status['time'] / self.worker_status['requests']:.1f} 秒" if self.worker_status['requests'] else "无数据"
+        worker_status = await self.worker_status.all()
+        waiting_delay = f"{worker_status['time'] / worker_status['requests']:.1f} 秒" if worker_status['requests'] else "无数据"
         msg = f"ℹ️ 群组信息: \n\n"
         fields = [
             f"群名称: [{group.title}](t.me/{group.username})",
@@ -286,23 +289,14 @@ class Manage:
         parameters: dict,
     ):
         sorting, desc = parameters.get("lgm_sorting", ("role", True))
-        members = self.group.members.where(Member.role >= MemberRole.GUEST)
-        if sorting == "role":
-            if desc:
-                members = members.order_by(Member.role.desc())
-            else:
-                members = members.order_by(Member.role)
-        else:
-            if desc:
-                members = members.order_by(Member.last_activity.desc())
-            else:
-                members = members.order_by(Member.last_activity)
-        items = []
-        m: Member
-        for i, m in enumerate(members.iterator()):
-            item = f"{i+1} | [{truncate_str(m.user.name, 20)}](t.me/{m.user.username})"
-            items.append((item, str(i + 1), m.id))
-        return items
+        members = Member.select(Member, User).join(User).where(Member.group == self.group, Member.role >= MemberRole.GUEST)
+        key = Member.role if sorting == "role" else Member.last_activity
+
+        def render(i: int, m: Member):
+            item = f"{i} | [{truncate_str(m.user.name, 20)}](t.me/{m.user.username})"
+            return (item, str(i), m.id)
+
+        return Paged(members, key, desc, self.group.n_members, render)
 
     @operation(MemberRole.ADMIN_BAN)
     async def button_lgm_switch_activity(
@@ -366,6 +360,67 @@ class Manage:
             await context.answer("🔽 权限由高到低")
         await self.to_menu("list_group_members", context)
 
+    def search_members(self: "anonyabbot.GroupBot", query: str, limit: int = 20) -> List[Member]:
+        """Search active members by mask, name or username."""
+        members = Member.select(Member, User).join(User).where(Member.group == self.group, Member.role >= MemberRole.GUEST)
+        found = list(members.where(Member.pinned_mask == query))
+        holder = self.unique_mask_pool.holder(query)
+        if holder:
+            found += [m for m in members.where(Member.id == holder) if m not in found]
+        within = Member.select(Member.user).where(Member.group == self.group, Member.role >= MemberRole.GUEST)
+        users = User.search(query, within=within, limit=limit)
+        if users:
+            by_user = {m.user_id: m for m in members.where(Member.user << [u.id for u in users])}
+            found += [by_user[u.id] for u in users if u.id in by_user and by_user[u.id] not in found]
+        return found[:limit]
+
+    @operation(MemberRole.ADMIN_BAN)
+    async def on_lgm_search(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        self.set_conversation(context, "lgm_search")
+        return "👁️‍🗨️ 这个面板仅对您可见\n⬇️ 输入要搜索的成员名称, 用户名或面具:"
+
+    @operation(MemberRole.ADMIN_BAN)
+    async def header_lgm_search_result(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        return f"🔍 搜索 `{parameters.get('lgm_query', '')}` 的结果:\n"
+
+    @operation(MemberRole.ADMIN_BAN)
+    async def on_lgm_search_result(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        items = []
+        m: Member
+        for i, m in enumerate(self.search_members(parameters.get("lgm_query", ""))):
+            item = f"{i+1} | [{truncate_str(m.user.name, 20)}](t.me/{m.user.username})"
+            items.append((item, str(i + 1), m.id))
+        return items
+
+    @operation(MemberRole.ADMIN_BAN)
+    async def on_jump_lgm_search_result(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        parameters["member_id"] = int(parameters["jump_lgm_search_result_id"])
+        await self.to_menu("_member_detail", context)
+
     @operation(MemberRole.ADMIN_BAN)
     async def on_jump_member_detail(
         self: "anonyabbot.GroupBot",
@@ -465,7 +520,7 @@ class Manage:
             current_selection = None
         if not current_selection:
             if target.ban_group:
-                parameters["embg_current"] = current_selection = [t.type.value for t in target.ban_group.entries.iterator()]
+                parameters["embg_current"] = current_selection = [t.value for t in target.ban_group.bans()]
             else:
                 parameters["embg_current"] = current_selection = [t.value for t in self.group.default_bans()]
 
@@ -696,5 +751,126 @@ class Manage:
         else:
             self.group.inactive_leave = int(r)
         self.group.save()
+        self.group.sweep_inactive()
+        await context.answer('✅ 成功')
+        await self.to_menu('group_other_settings', context)
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def button_edit_retention(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        if self.group.retention_days is None:
+            return "消息保留期限 (默认)"
+        return "消息保留期限 " + (f"({self.group.retention_days} 天)" if self.group.retention_days else "(永久)")
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def on_edit_retention(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        return (
+            "ℹ️ 消息记录保留多少天后将被归档?\n\n"
+            "ℹ️ 被归档的消息将无法被回复, 删除或置顶, 置顶的消息不会被归档."
+        )
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def items_edit_retention(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        return [Element(str(i), str(i)) for i in ["默认", 7, 30, 90, 365, "永久"]]
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def on_er_done(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        r = parameters["er_done_id"]
+        if r == "默认":
+            self.group.retention_days = None
+        elif r == "永久":
+            self.group.retention_days = 0
+        else:
+            self.group.retention_days = int(r)
+        self.group.save()
+        await context.answer('✅ 成功')
+        await self.to_menu('group_other_settings', context)
+
+    mask_modes = {
+        "emoji": "单个 emoji",
+        "emoji_pair": "emoji 组合",
+        "emoji_digit": "emoji 加数字",
+        "custom": "自定义字符",
+    }
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def button_edit_mask_namespace(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        if self.group.mask_namespace is None:
+            return "面具样式 (默认)"
+        return f"面具样式 ({self.mask_modes.get(self.group.mask_namespace, self.group.mask_namespace)})"
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def on_edit_mask_namespace(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        return (
+            "ℹ️ 自动分配的面具使用哪种样式?\n\n"
+            "ℹ️ 单个 emoji 用完后, 其他样式将依次使用更长的组合, 适用于发言人数较多的群组."
+        )
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def items_edit_mask_namespace(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        return [Element("默认", "默认")] + [Element(d, m) for m, d in self.mask_modes.items()]
+
+    @operation(MemberRole.ADMIN_ADMIN)
+    async def on_emn_done(
+        self: "anonyabbot.GroupBot",
+        handler,
+        client: Client,
+        context: TC,
+        parameters: dict,
+    ):
+        r = parameters["emn_done_id"]
+        if r == "custom":
+            self.set_conversation(context, "emn_alphabet")
+            msg = f"ℹ️ 当前的自定义字符为 `{self.group.mask_alphabet}`\n\n" if self.group.mask_alphabet else ""
+            msg += (
+                "👁️‍🗨️ 这个面板仅对您可见\n"
+                "⬇️ 输入用于组成面具的字符或 emoji:\n"
+                "ℹ️ (可以用空格分隔多个字符组成的词)"
+            )
+            return msg
+        self.group.mask_namespace = None if r == "默认" else r
+        self.group.save()
+        self.unique_mask_pool.configure(self.group.mask_mode, self.group.mask_alphabet)
         await context.answer('✅ 成功')
         await self.to_menu('group_other_settings', context)
@@ -1,98 +1,272 @@
-import asyncio
-from datetime import datetime, timedelta
+import heapq
+from math import gcd, prod
 import random
-from typing import Dict, Tuple
+import string
+import time
+from typing import Dict, List, Tuple
 
 import emoji
 
 from ...model import Member
-from ...cache import CacheDict
+from ...cache import Cache
+from ...config import config
 
 
 class MaskNotAvailable(Exception):
     pass
 
 
-class UniqueMask:
-    emojis = emoji.distinct_emoji_list(
-        "🐶🐱🐹🐰🦊🐼🐯🐮🦁🐸🐵🐔🐧🐥🦆🦅🦉🦄🐝🦋🐌🐙🦖"
-        "🦀🐠🐳🐘🐿👻🎃🦕🐡🎄🍄🍁🐚🧸🎩🕶🐟🐬🦁🐲🚤🛶🦞"
-        "🦑🎄🐚👽🎃🧸♠️♣️♥️♦️🃏🔮🛸⛵️🎲🧊🍩🍪🍭🌶🍗🍖☘️🍄🤡"
-        "🧩🌀🏮🪄🏀⚽️🏈🎱🪁🍥🍦🧁🍓🫐🍇🍉🍋🍐🍎🍒🍑🥝🍆"
-        "🥑🥕🌽🥐🎷♟🏖🏔⚓️🛵🔯☮️☯️🆙🏴‍☠️⏳⛩🦧🌴🌷🌞🧶🐳🧿"
+class MaskNamespace:
+    """
+    Ordered space of masks, made of tiers whose masks are combinations of one token from each part.
+    A mask is decoded from its position in mixed radix when it is allocated, so the space is never materialized.
+    Positions of each tier are visited in a shuffled order by striding with a step coprime to the tier size.
+    """
+
+    emojis = list(
+        dict.fromkeys(
+            emoji.distinct_emoji_list(
+                "🐶🐱🐹🐰🦊🐼🐯🐮🦁🐸🐵🐔🐧🐥🦆🦅🦉🦄🐝🦋🐌🐙🦖"
+                "🦀🐠🐳🐘🐿👻🎃🦕🐡🎄🍄🍁🐚🧸🎩🕶🐟🐬🦁🐲🚤🛶🦞"
+                "🦑🎄🐚👽🎃🧸♠️♣️♥️♦️🃏🔮🛸⛵️🎲🧊🍩🍪🍭🌶🍗🍖☘️🍄🤡"
+                "🧩🌀🏮🪄🏀⚽️🏈🎱🪁🍥🍦🧁🍓🫐🍇🍉🍋🍐🍎🍒🍑🥝🍆"
+                "🥑🥕🌽🥐🎷♟🏖🏔⚓️🛵🔯☮️☯️🆙🏴‍☠️⏳⛩🦧🌴🌷🌞🧶🐳🧿"
+            )
+        )
     )
+    digits = list(string.digits)
+
+    def __init__(self, tiers: List[List[List[str]]]):
+        self.tiers = []
+        for parts in tiers:
+            size = prod(len(p) for p in parts)
+            if not size:
+                continue
+            step = random.randrange(size // 2, size) if size > 2 else 1
+            while gcd(step, size) != 1:
+                step -= 1
+            self.tiers.append((parts, [set(p) for p in parts], size, step, random.randrange(size)))
+        self.size = sum(t[2] for t in self.tiers)
+
+    @classmethod
+    def create(cls, mode: str = "emoji", alphabet: str = None):
+        e = cls.emojis
+        d = cls.digits
+        if mode == "emoji_pair":
+            return cls([[e], [e, e], [e, e, e]])
+        elif mode == "emoji_digit":
+            return cls([[e], [e, d], [e, d, d], [e, d, d, d]])
+        elif mode == "custom" and alphabet:
+            a = cls.split(alphabet)
+            return cls([[a], [a, a], [a, a, a]])
+        else:
+            return cls([[e]])
+
+    @staticmethod
+    def split(alphabet: str):
+        """Split an alphabet into tokens by whitespace if any, or else into emojis and single characters."""
+        if len(alphabet.split()) > 1:
+            return list(dict.fromkeys(alphabet.split()))
+        tokens = []
+        i = 0
+        for e in emoji.emoji_list(alphabet):
+            tokens.extend(alphabet[i : e["match_start"]])
+            tokens.append(e["emoji"])
+            i = e["match_end"]
+        tokens.extend(alphabet[i:])
+        return list(dict.fromkeys(t for t in tokens if not t.isspace()))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, k: int):
+        for parts, _, size, step, offset in self.tiers:
+            if k < size:
+                i = (offset + k * step) % size
+                tokens = []
+                for p in reversed(parts):
+                    i, r = divmod(i, len(p))
+                    tokens.append(p[r])
+                return "".join(reversed(tokens))
+            k -= size
+        raise IndexError(k)
+
+    def __contains__(self, mask: str):
+        return any(self._match(mask, sets) for _, sets, _, _, _ in self.tiers)
+
+    def _match(self, mask: str, sets: List[set]):
+        if not sets:
+            return not mask
+        for i in range(1, len(mask) + 1):
+            if mask[:i] in sets[0] and self._match(mask[i:], sets[1:]):
+                return True
+        return False
+
+
+class UniqueMask:
+    """
+    Pool of unique masks of a group, a mask can be taken by another member when it is not used for 3 days.
+    Masks are stored in redis hashes and written per field, only when a mask changes hands or its use time is stale.
+    Released masks are kept in a free list, masks never used are allocated lazily from the namespace,
+    and held masks are kept in a heap ordered by last use.
+    """
+
+    emojis = MaskNamespace.emojis
+
+    reuse = 3 * 86400
+    resolution = 3600
 
     def __init__(self, token: str):
-        self.lock = asyncio.Lock()
         self.token = token
-        self.users: Dict[int, str] = CacheDict(f'group.{self.token}.unique_mask.users')
-        self.masks: Dict[str, Tuple[int, datetime]] = CacheDict(f'group.{self.token}.unique_mask.masks')
+        self.users_key = f"group.{self.token}.unique_mask.members"
+        self.masks_key = f"group.{self.token}.unique_mask.holders"
+        self.loaded = False
+        self.users: Dict[int, str] = {}
+        self.masks: Dict[str, Tuple[int, float]] = {}
+        self.saved: Dict[str, float] = {}
+        self.free: List[str] = []
+        self.heap: List[Tuple[float, str]] = []
+        self.mode: str = None
+        self.namespace: MaskNamespace = None
+        self.cursor = 0
+
+    @property
+    def redis(self):
+        return Cache.client()
+
+    def load(self):
+        if self.loaded:
+            return
+        self.migrate()
+        for uid, role in self.redis.hgetall(self.users_key).items():
+            self.users[int(uid)] = role.decode()
+        for role, value in self.redis.hgetall(self.masks_key).items():
+            uid, t = value.decode().split(":")
+            self.masks[role.decode()] = (int(uid), float(t))
+            self.saved[role.decode()] = float(t)
+        self.heap = [(t, role) for role, (_, t) in self.masks.items()]
+        heapq.heapify(self.heap)
+        if not self.namespace:
+            self.configure(config.snapshot.mask_namespace)
+        self.loaded = True
+
+    def migrate(self):
+        """Convert masks saved as pickled dicts by older versions into hashes."""
+        legacy = Cache(f"group.{self.token}.unique_mask")
+        users = legacy.get("users", default=None)
+        masks = legacy.get("masks", default=None)
+        if users is None and masks is None:
+            return
+        pipe = self.redis.pipeline()
+        if users:
+            pipe.hset(self.users_key, mapping={uid: role for uid, role in users.items()})
+        if masks:
+            pipe.hset(self.masks_key, mapping={role: f"{uid}:{t.timestamp()}" for role, (uid, t) in masks.items()})
+        pipe.delete(legacy.get_path("users"), legacy.get_path("masks"))
+        pipe.execute()
+
+    def configure(self, mode: str = "emoji", alphabet: str = None):
+        """Use a new namespace to allocate masks from, masks held already are kept."""
+        self.mode = mode
+        self.namespace = MaskNamespace.create(mode, alphabet)
+        self.free = []
+        self.cursor = 0
 
-    def save(self):
-        self.users.save()
-        self.masks.save()
+    def holder(self, role: str):
+        self.load()
+        held = self.masks.get(role, None)
+        return held[0] if held else None
+
+    def _assign(self, uid: int, role: str, pipe):
+        now = time.time()
+        self.users[uid] = role
+        self.masks[role] = (uid, now)
+        self.saved[role] = now
+        heapq.heappush(self.heap, (now, role))
+        pipe.hset(self.users_key, uid, role)
+        pipe.hset(self.masks_key, role, f"{uid}:{now}")
+
+    def _release(self, role: str, pipe):
+        uid, _ = self.masks.pop(role)
+        self.saved.pop(role, None)
+        if self.users.get(uid, None) == role:
+            del self.users[uid]
+            pipe.hdel(self.users_key, uid)
+        pipe.hdel(self.masks_key, role)
+
+    def _recycle(self, role: str):
+        if role in self.namespace:
+            self.free.append(role)
 
     async def take_mask(self, member: Member, role: str):
-        async with self.lock:
-            if role in self.masks:
-                uid, t = self.masks[role]
-                if t > (datetime.now() - timedelta(days=3)):
-                    return False
-                else:
-                    self.users.pop(uid, None)
-            self.users[member.id] = role
-            self.masks[role] = (member.id, datetime.now())
-            return True   
+        self.load()
+        if role in self.masks:
+            _, t = self.masks[role]
+            if t > time.time() - self.reuse:
+                return False
+        pipe = Cache.async_client().pipeline()
+        if role in self.masks:
+            self._release(role, pipe)
+        old_role = self.users.get(member.id, None)
+        if old_role:
+            self._release(old_role, pipe)
+            self._recycle(old_role)
+        self._assign(member.id, role, pipe)
+        await pipe.execute()
+        return True
 
     async def has_mask(self, member: Member):
-        async with self.lock:
-            return member.id in self.users
+        self.load()
+        return member.id in self.users
 
     async def mask_for(self, member: Member):
-        async with self.lock:
-            if member.id in self.users:
-                return self.users[member.id]
-            else:
-                return None
+        self.load()
+        return self.users.get(member.id, None)
 
     async def get_mask(self, member: Member, renew=False):
-        async with self.lock:
-            if member.id in self.users:
-                if renew:
-                    old_role = self.users[member.id]
-                    role = self._get_mask()
-                    self.users[member.id] = role
-                    del self.masks[old_role]
-                    self.masks[role] = (member.id, datetime.now())
-                    self.save()
-                    return True, role
-                else:
-                    role = self.users[member.id]
-                    self.masks[role] = (member.id, datetime.now())
-                    self.save()
-                    return False, role
-            else:
-                role = self._get_mask()
-                self.users[member.id] = role
-                self.masks[role] = (member.id, datetime.now())
-                self.save()
-                return True, role
-
-    def _get_mask(self):
-        unused = [e for e in self.emojis if e not in self.masks.keys()]
-        if unused:
-            return random.choice(unused)
-        oldest_avail_role = None
-        oldest_avail_timestamp = None
-        for role, (uid, t) in self.masks.items():
-            if t > (datetime.now() - timedelta(days=3)):
+        self.load()
+        role = self.users.get(member.id, None)
+        if role and not renew:
+            now = time.time()
+            self.masks[role] = (member.id, now)
+            if now - self.saved.get(role, 0) > self.resolution:
+                self.saved[role] = now
+                await Cache.async_client().hset(self.masks_key, role, f"{member.id}:{now}")
+            return False, role
+        pipe = Cache.async_client().pipeline()
+        new_role = self._get_mask(pipe)
+        if role:
+            self._release(role, pipe)
+            self._recycle(role)
+        self._assign(member.id, new_role, pipe)
+        await pipe.execute()
+        return True, new_role
+
+    def _get_mask(self, pipe):
+        """Take an unused mask, or reclaim the mask unused for the longest time if it is unused for 3 days."""
+        while self.free:
+            i = random.randrange(len(self.free))
+            self.free[i], self.free[-1] = self.free[-1], self.free[i]
+            role = self.free.pop()
+            if role not in self.masks:
+                return role
+        while self.cursor < len(self.namespace):
+            role = self.namespace[self.cursor]
+            self.cursor += 1
+            if role not in self.masks:
+                return role
+        while self.heap:
+            t, role = self.heap[0]
+            held = self.masks.get(role, None)
+            if not held:
+                heapq.heappop(self.heap)
                 continue
-            if (not oldest_avail_role) or (t < oldest_avail_timestamp):
-                oldest_avail_role = role
-                oldest_avail_timestamp = t
-        if oldest_avail_role:
-            uid, _ = self.masks[oldest_avail_role]
-            self.users.pop(uid, None)
-            return oldest_avail_role
-        else:
-            raise MaskNotAvailable()
+            if held[1] > t:
+                heapq.heapreplace(self.heap, (held[1], role))
+                continue
+            if t > time.time() - self.reuse:
+                break
+            heapq.heappop(self.heap)
+            self._release(role, pipe)
+            return role
+        raise MaskNotAvailable()
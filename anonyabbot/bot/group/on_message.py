@@ -10,9 +10,9 @@ from pyrogram.errors import MessageDeleteForbidden
 import anonyabbot
 
 from ...utils import async_partial
-from ...model import Member, BanType, MemberRole, Message, PMMessage, RedirectedMessage, OperationError, User
+from ...model import Member, BanType, MemberRole, Message, PMMessage, OperationError, User
 from .common import operation
-from .mask import MaskNotAvailable
+from .mask import MaskNamespace, MaskNotAvailable
 from .worker import BroadcastOperation, EditOperation
 
 
@@ -144,6 +144,28 @@ class OnMessage:
                         self.group.password = content
                         self.group.save()
                         await info(f"✅ 成功")
+                elif conv.status == "emn_alphabet":
+                    content = message.text or message.caption
+                    if not content:
+                        await info(f"⚠️ 不是有效的消息")
+                    elif len(MaskNamespace.split(content)) < 10:
+                        await info(f"⚠️ 至少需要 10 个不同的字符")
+                    else:
+                        self.group.mask_namespace = "custom"
+                        self.group.mask_alphabet = content
+                        self.group.save()
+                        self.unique_mask_pool.configure(self.group.mask_mode, self.group.mask_alphabet)
+                        await info(f"✅ 成功")
+                elif conv.status == "lgm_search":
+                    content = message.text or message.caption
+                    if not content:
+                        await info(f"⚠️ 不是有效的消息")
+                    elif not self.search_members(content.strip()):
+                        await info(f"⚠️ 没有找到匹配的成员")
+                    else:
+                        await self.to_menu_scratch(
+                            "_lgm_search_result", message.chat.id, message.from_user.id, lgm_query=content.strip()
+                        )
                 elif conv.status == "gp_password":
                     event, container = conv.data
                     try:
@@ -245,12 +267,10 @@ class OnMessage:
         rm = message.reply_to_message
         
         if rm:
-            rmm: Message = Message.get_or_none(mid=rm.id, member=member)
+            rmm: Message = Message.get_or_none(group=self.group, member=member, mid=rm.id)
             if not rmm:
-                rmr = RedirectedMessage.get_or_none(mid=rm.id, to_member=member)
-                if rmr:
-                    rmm: Message = rmr.message
-                else:
+                rmm: Message = Message.from_redirect(member, rm.id)
+                if not rmm:
                     pmm: PMMessage = PMMessage.get_or_none(redirected_mid=rm.id, to_member=member)
                     if pmm:
                         await self.pm(message)
@@ -293,14 +313,15 @@ class OnMessage:
         await message.delete()
         await info("⚠️ 未知命令")
 
-    @operation(req=None, conversation=True, allow_disabled=True)
+    @operation(req=None, conversation=True, allow_disabled=True, touch=False)
     async def on_edit_message(self: "anonyabbot.GroupBot", client: Client, message: TM):
         member: Member = message.from_user.get_member(self.group)
         if not member:
             return
-        mr = Message.get_or_none(mid=message.id)
+        mr = Message.get_or_none(group=self.group, member=member, mid=message.id)
         if not mr:
             return
+        await self.touch()
         e = asyncio.Event()
         op = EditOperation(context=message, member=member, finished=e, message=mr)
         await self.queue.put(op)
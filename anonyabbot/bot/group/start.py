@@ -127,23 +127,16 @@ class Start:
                 if len(cmds) == 2:
                     if cmds[1].startswith("_c_"):
                         code = remove_prefix(cmds[1], "_c_")
-                        try:
-                            invitor: Member
-                            invitor, usage = self.invite_codes.get(code)
-                        except KeyError:
+                        invitor_id = await self.invite_codes.invitor(code)
+                        invitor: Member = Member.get_or_none(id=invitor_id) if invitor_id else None
+                        if (not invitor) or invitor.check_ban(BanType.INVITE):
                             await info('🚫 这个邀请链接已失效')
                             return False
-                        else:
-                            if usage <= 0:
-                                await info('🚫 这个邀请链接已失效')
-                                return False
-                            if invitor.check_ban(BanType.INVITE):
-                                await info('🚫 这个邀请链接已失效')
-                                return False
-                            member.invitor = invitor
-                            usage -= 1
-                            self.invite_codes.set(code, (invitor, usage), ttl=-1)
-                            return True
+                        if not await self.invite_codes.redeem(code):
+                            await info('🚫 这个邀请链接已失效')
+                            return False
+                        member.invitor = invitor
+                        return True
                     else:
                         await info('🚫 这是一个私有群组，只能通过邀请链接加入')
                         return False
@@ -189,7 +182,7 @@ class Start:
                     "ℹ️ 该群组由 @anonycnbot 创建.\n\n"
                     "🌈 群组状态：\n\n"
                     f"成员数：{self.group.n_members}\n"
-                    f"非游客成员数：{self.group.s_all_has_role(MemberRole.MEMBER).count()}\n\n"
+                    f"非游客成员数：{self.group.n_full_members}\n\n"
                     "👤 您的成员信息：\n\n"
                     f"权限身份：{member.role.display.title()}\n"
                     f'面具：{mask if mask else "<未激活>"}\n\n'
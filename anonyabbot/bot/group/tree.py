@@ -48,15 +48,21 @@ class Tree:
                     M("toggle_group_privacy_confirm"): {M("toggle_group_privacy", "⚠️ 是的, 我确定.")},
                     M("edit_password"): None,
                 },
-                P("list_group_members", "👤 成员列表", extras=["_lgm_switch_activity", "_lgm_switch_role"]): {M("jump_member_detail")},
+                P("list_group_members", "👤 成员列表", extras=["_lgm_switch_activity", "_lgm_switch_role", "_lgm_search"]): {
+                    M("jump_member_detail")
+                },
                 M("group_other_settings", "💫 更多设置", "⬇️ 点击下方按钮以配置群组:", per_line=1): {
                     K("edit_inactive_leave"): {M("eil_done"): None,},
+                    K("edit_retention"): {M("er_done"): None,},
+                    K("edit_mask_namespace"): {M("emn_done"): None,},
                 },
                 M("close_group_details", "❌ 关闭"): None,
             },
             M("_edbg_done"): None,
             M("_lgm_switch_activity"): None,
             M("_lgm_switch_role"): None,
+            M("_lgm_search", "🔍 搜索", back="list_group_members"): None,
+            P("_lgm_search_result", back="list_group_members"): {M("jump_lgm_search_result")},
             M("_member_detail", back="list_group_members"): {
                 K("edit_member_role_select", "👑 修改角色", "👑 选择角色"): {M("edit_member_role")},
                 P("edit_member_ban_group", "⚠️ 修改权限", extras="_edit_member_ban_group_select_time"): {M("embg_select")},
@@ -1,4 +1,5 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import copy
 from dataclasses import dataclass, field
 from datetime import datetime
@@ -16,8 +17,9 @@ from pyrogram.enums import ParseMode
 
 import anonyabbot
 
-from ...cache import CacheQueue
-from ...model import MemberRole, Message, Member, BanType, RedirectedMessage
+from ...cache import AsyncCacheQueue
+from ...config import Settings, config
+from ...model import Activity, MemberRole, Message, Member, BanType
 from .. import pool
 from . import rosautils as _r
 
@@ -63,7 +65,7 @@ class BulkRedirectOperation(Operation):
 class BulkPinOperation(Operation):
     messages: List[Message]
 
-class WorkerQueue(CacheQueue):
+class WorkerQueue(AsyncCacheQueue):
     __noproxy__ = ("_bot",)
     
     def __init__(self, path=None, bot=None):
@@ -88,17 +90,60 @@ class WorkerQueue(CacheQueue):
                     setattr(ic, '_client', self._bot)
         return val
 
+class VoiceChanger:
+    """Threads to disguise voices off the event loop, which are resized when the config is reloaded."""
+
+    executor: ThreadPoolExecutor = None
+    workers = 0
+
+    @classmethod
+    def configure(cls, settings: Settings):
+        if settings.voice_workers == cls.workers:
+            return
+        old = cls.executor
+        cls.executor = ThreadPoolExecutor(max(1, settings.voice_workers), thread_name_prefix="voice")
+        cls.workers = settings.voice_workers
+        if old:
+            old.shutdown(wait=False)
+
+    @staticmethod
+    def transform(f_ogg: BytesIO):
+        f_ogg.seek(0)
+        a_ogg = AudioSegment.from_ogg(f_ogg)
+        f_wav = BytesIO()
+        a_ogg.export(f_wav, format="wav")
+        f_wav.seek(0)
+        obj, sr = librosa.load(f_wav, sr=None)
+        obj = _r.change_pitch(obj, sr, random.choice([-3, 3]))
+        obj = _r.change_male(obj, sr, random.choice([600, 900]))
+        f_wav_mod = BytesIO()
+        sf.write(f_wav_mod, obj, sr, format='wav')
+        f_wav_mod.seek(0)
+        a_wav = AudioSegment.from_wav(f_wav_mod)
+        duration = int(a_wav.duration_seconds)
+        f_ogg_mod = BytesIO()
+        a_wav.export(f_ogg_mod, format="ogg")
+        f_ogg_mod.seek(0)
+        f_ogg_mod.name = 'tmp.ogg'
+        return f_ogg_mod, duration
+
+    @classmethod
+    async def disguise(cls, f_ogg: BytesIO):
+        if not cls.executor:
+            cls.configure(config.snapshot)
+        return await asyncio.get_running_loop().run_in_executor(cls.executor, cls.transform, f_ogg)
+
+
+config.subscribe(VoiceChanger.configure)
+
+
 class Worker:
-    async def report_status(self: "anonyabbot.GroupBot", time: int, requests: int, errors: int):
-        self.worker_status['time'] += time
-        self.worker_status['requests'] += requests
-        self.worker_status['errors'] += errors
-        self.worker_status.save()
-        async with pool.worker_status_lock:
-            pool.worker_status['time'] += time
-            pool.worker_status['requests'] += requests
-            pool.worker_status['errors'] += errors
-            pool.worker_status.save()
+    async def report_status(self: "anonyabbot.GroupBot", time: int, requests: int, errors: int, broadcast: bool = False):
+        # Only copies of new messages count as deliveries, not edits, deletes or pins of existing copies.
+        Activity.record(self.group.id, deliveries=requests - errors if broadcast else 0, errors=errors)
+        counts = {'time': float(time), 'requests': requests, 'errors': errors}
+        await self.worker_status.incr_many(counts)
+        await pool.worker_status.incr_many(counts)
     
     async def bulk_redirector(self: "anonyabbot.GroupBot", op: BulkRedirectOperation):
         try:
@@ -107,7 +152,7 @@ class Worker:
             if op.member.is_banned:
                 return
             for message in op.messages:
-                await asyncio.sleep(1)
+                await asyncio.sleep(config.snapshot.redirect_interval)
                 if message.member.id == op.member.id:
                     continue
                 
@@ -145,7 +190,7 @@ class Worker:
                         op.member.save()
                     op.errors += 1
                 else:
-                    RedirectedMessage(mid=masked_message.id, message=message, to_member=op.member).save()
+                    message.add_redirects([(op.member, masked_message.id)])
                 finally:
                     op.requests += 1
         except Exception as e:
@@ -215,23 +260,7 @@ class Worker:
                     if op.context.voice:
                         if self.group.is_prime or op.member.user.is_prime:
                             f_ogg = await self.bot.download_media(op.context, in_memory=True)
-                            f_ogg.seek(0)
-                            a_ogg = AudioSegment.from_ogg(f_ogg)
-                            f_wav = BytesIO()
-                            a_ogg.export(f_wav, format="wav")
-                            f_wav.seek(0)
-                            obj, sr = librosa.load(f_wav, sr=None)
-                            obj = _r.change_pitch(obj, sr, random.choice([-3, 3]))
-                            obj = _r.change_male(obj, sr, random.choice([600, 900]))
-                            f_wav_mod = BytesIO()
-                            sf.write(f_wav_mod, obj, sr, format='wav')
-                            f_wav_mod.seek(0)
-                            a_wav = AudioSegment.from_wav(f_wav_mod)
-                            duration = int(a_wav.duration_seconds)
-                            f_ogg_mod = BytesIO()
-                            a_wav.export(f_ogg_mod, format="ogg")
-                            f_ogg_mod.seek(0)
-                            f_ogg_mod.name = 'tmp.ogg'
+                            f_ogg_mod, duration = await VoiceChanger.disguise(f_ogg)
                             voice_file_id = None
                         else:
                             voice_file_id = op.context.voice.file_id
@@ -254,8 +283,6 @@ class Worker:
                     for m in self.group.user_members():
                         if m.id == op.member.id:
                             continue
-                        if m.is_banned:
-                            continue
                         if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
                             continue
 
@@ -297,9 +324,10 @@ class Worker:
                                 m.save()
                             op.errors += 1
                         else:
-                            RedirectedMessage(mid=masked_message.id, message=op.message, to_member=m).save()
+                            op.message.add_redirects([(m, masked_message.id)])
                         finally:
                             op.requests += 1
+                    op.message.pack_redirects()
 
                 elif isinstance(op, EditOperation):
                     if self.group.cannot(BanType.RECEIVE):
@@ -317,8 +345,6 @@ class Worker:
                     for m in self.group.user_members():
                         if m.id == op.member.id:
                             continue
-                        if m.is_banned:
-                            continue
                         if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
                             continue
 
@@ -341,8 +367,6 @@ class Worker:
 
                     m: Member
                     for m in self.group.user_members():
-                        if m.is_banned:
-                            continue
                         if m.check_ban(BanType.RECEIVE, check_group=False, fail=False):
                             continue
 
@@ -368,8 +392,6 @@ class Worker:
 
                     m: Member
                     for m in self.group.user_members():
-                        if m.is_banned:
-                            continue
                         
                         try:
                             if m.id == op.message.member.id:
@@ -397,8 +419,6 @@ class Worker:
 
                     m: Member
                     for m in self.group.user_members():
-                        if m.is_banned:
-                            continue
 
                         try:
                             if m.id == op.message.member.id:
@@ -415,7 +435,7 @@ class Worker:
                         finally:
                             op.requests += 1
                 waiting_time = (datetime.now() - op.created).total_seconds() 
-                await self.report_status(waiting_time, op.requests, op.errors)
+                await self.report_status(waiting_time, op.requests, op.errors, broadcast=isinstance(op, BroadcastOperation))
             except Exception as e:
                 self.log.opt(exception=e).warning("Worker error:")
             finally:
@@ -1,11 +1,16 @@
 import asyncio
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+import time
 
 from loguru import logger
+from pyrogram.errors import AccessTokenExpired, AccessTokenInvalid, FloodWait, Unauthorized
 
 from ..utils import AsyncTaskPool
-from ..cache import CacheDict
-from ..model import Group, User
+from ..cache import CacheCounter
+from ..config import config
+from ..model import Activity, ArchivedMessage, Expiry, Group, User
 from .group import GroupBot
 
 pool = AsyncTaskPool()
@@ -18,15 +23,9 @@ start_queue = asyncio.Queue()
 
 start_time = datetime.now()
 
-worker_status = CacheDict(
-    'system.statistics.worker.status',
-    default={
-        'time': 0,
-        'requests': 0,
-        'errors': 0
-    }
-)
-worker_status_lock = asyncio.Lock()
+archiver = ThreadPoolExecutor(1, thread_name_prefix="archive")
+
+worker_status = CacheCounter('system.statistics.worker.status', fields=('time', 'requests', 'errors'))
 
 async def queue_monitor():
     while True:
@@ -62,19 +61,139 @@ async def start_group_bot(token: str, creator: User):
         return cls
 
 
+async def boot_group_bot(g: Group, semaphore: asyncio.Semaphore):
+    """Start the bot of a group when a slot is free, retrying with backoff, and return whether it is running."""
+    settings = config.snapshot
+    for attempt in range(settings.startup_retries + 1):
+        async with semaphore:
+            event = asyncio.Event()
+            token_start_event[g.token] = event
+            await start_queue.put((g.token, g.creator, event))
+            try:
+                await asyncio.wait_for(event.wait(), settings.startup_timeout)
+            except asyncio.TimeoutError:
+                e = TimeoutError(f"not started in {settings.startup_timeout:g} seconds")
+            else:
+                e = token_cls[g.token].boot_exception
+        if not e:
+            return True
+        await stop_group_bot(g.token)
+        if isinstance(e, (Unauthorized, AccessTokenInvalid, AccessTokenExpired)) or attempt == settings.startup_retries:
+            logger.warning(f"Failed to start groupbot of @{g.username}: {e}")
+            return False
+        delay = e.value if isinstance(e, FloodWait) else settings.startup_backoff * 2**attempt
+        logger.debug(f"Failed to start groupbot of @{g.username} ({e}), retrying in {delay} seconds.")
+        await asyncio.sleep(delay)
+
+
 async def start_groups():
-    events = []
-    g: Group
-    for g in Group.select().where(~(Group.disabled)):
-        e = asyncio.Event()
-        events.append(e)
-        await start_queue.put((g.token, g.creator, e))
-    for e in events:
-        await e.wait()
-    logger.info("All groupbots are started.")
+    """Start bots of all groups with bounded concurrency, recently active groups first."""
+    begin = time.monotonic()
+    groups = list(Group.select().where(~(Group.disabled)).order_by(Group.last_activity.desc()))
+    semaphore = asyncio.Semaphore(max(1, config.snapshot.startup_concurrency))
+    step = max(1, len(groups) // 10)
+    results = []
+
+    async def boot(g: Group):
+        results.append(await boot_group_bot(g, semaphore))
+        if len(results) % step == 0 and len(results) < len(groups):
+            logger.info(f"Started {len(results)}/{len(groups)} groupbots in {time.monotonic() - begin:.0f} seconds.")
+
+    # Semaphore waiters are woken in order, so bots are started in the order of groups.
+    await asyncio.gather(*[boot(g) for g in groups])
+    logger.info(
+        f"All groupbots are started in {time.monotonic() - begin:.1f} seconds "
+        f"({sum(results)} running, {len(results) - sum(results)} failed)."
+    )
+
+
+async def retention():
+    while True:
+        chunk = config.snapshot.retention_chunk
+        redirects = config.snapshot.retention_redirects
+        g: Group
+        for g in Group.select().where(~(Group.disabled)):
+            days = g.retention
+            if not days:
+                continue
+            before = datetime.now() - timedelta(days=days)
+            total = 0
+            try:
+                while True:
+                    # Chunks are archived in a thread, so that bots keep running while a chunk is written.
+                    archive = partial(ArchivedMessage.archive, g, before, limit=chunk, max_redirects=redirects)
+                    n = await asyncio.get_running_loop().run_in_executor(archiver, archive)
+                    if not n:
+                        break
+                    total += n
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.opt(exception=e).warning(f"Error when archiving messages of group @{g.username}:")
+            if total:
+                logger.info(f"Archived {total} messages of group @{g.username} older than {days} days.")
+        await asyncio.sleep(config.snapshot.retention_interval)
+
+
+async def inactive():
+    while True:
+        g: Group
+        for g in Group.select().where(~(Group.disabled), Group.inactive_leave > 0):
+            try:
+                n = g.sweep_inactive()
+            except Exception as e:
+                logger.opt(exception=e).warning(f"Error when removing inactive members of group @{g.username}:")
+            else:
+                if n:
+                    logger.info(f"Set {n} members of group @{g.username} inactive for {g.inactive_leave} days as left.")
+        await asyncio.sleep(config.snapshot.inactive_interval)
+
+
+async def activity():
+    while True:
+        await asyncio.sleep(config.snapshot.activity_interval)
+        try:
+            Activity.flush()
+            Activity.prune(config.snapshot.activity_hourly_days)
+        except Exception as e:
+            logger.opt(exception=e).warning("Error when writing activity rollups:")
+
+
+async def expiry():
+    wake = asyncio.Event()
+    Expiry.notify = wake.set
+    logger.debug(f"Loaded {Expiry.load()} pending expiries of roles and bans.")
+    while True:
+        wake.clear()
+        delay = Expiry.delay()
+        try:
+            await asyncio.wait_for(wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            n = Expiry.run()
+        except Exception as e:
+            logger.opt(exception=e).warning("Error when lifting expired roles and bans:")
+        else:
+            if n:
+                logger.debug(f"Lifted {n} expired roles and bans.")
+
+
+def reconfigure_masks():
+    """Switch mask pools of groups using the default namespace to the configured one."""
+    for gb in list(token_cls.values()):
+        masks = gb.unique_mask_pool
+        if gb.group and gb.group.mask_namespace is None and masks.mode and masks.mode != gb.group.mask_mode:
+            masks.configure(gb.group.mask_mode, gb.group.mask_alphabet)
+            gb.log.info(f"Mask namespace is switched to {masks.mode}.")
 
 
 async def start():
+    loop = asyncio.get_running_loop()
+    config.subscribe(lambda _: loop.call_soon_threadsafe(reconfigure_masks))
     pool.add(queue_monitor())
     pool.add(start_groups())
+    pool.add(retention())
+    pool.add(inactive())
+    pool.add(activity())
+    pool.add(expiry())
     await pool.wait()
@@ -1,16 +1,127 @@
 import asyncio
-from collections import deque
+from collections import OrderedDict, deque
+import os
+import pickle
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+import uuid
+import weakref
 
 import dill
 from loguru import logger
 import redis
+import redis.asyncio
 import fakeredis
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from .config import config
 from .utils import Def, ProxyBase
 
+class Codec:
+    '''
+    Serializers of cached values. Encoded values are prefixed with a magic byte and the tag of the codec,
+    so that values written with any codec, or by older versions with untagged dill, can be read.
+    '''
+    
+    magic = b'\xa7'
+    codecs: Dict[str, Tuple[bytes, Callable, Callable]] = {
+        'pickle': (b'p', lambda val: pickle.dumps(val, protocol=5), pickle.loads),
+        'dill': (b'd', dill.dumps, dill.loads),
+    }
+    if msgpack:
+        codecs['msgpack'] = (b'm', msgpack.packb, lambda data: msgpack.unpackb(data, strict_map_key=False))
+    tags = {tag: loads for tag, _, loads in codecs.values()}
+    fallbacks = ('pickle', 'dill')
+    
+    @classmethod
+    def dumps(cls, val, codec='pickle'):
+        '''Encode with codec, or with a more general codec if it can not encode the value.'''
+        for name in (codec, *cls.fallbacks):
+            try:
+                tag, dumps, _ = cls.codecs[name]
+            except KeyError:
+                continue
+            try:
+                return cls.magic + tag + dumps(val)
+            except Exception:
+                continue
+        raise ValueError(f'can not encode value of type {type(val).__name__}')
+    
+    @classmethod
+    def loads(cls, data: bytes):
+        if data[:1] == cls.magic:
+            return cls.tags[data[1:2]](data[2:])
+        return dill.loads(data)
+
+class LocalCache:
+    '''
+    A bounded in-process LRU cache whose entries expire after a ttl.
+    Entries are encoded values, so that each reader decodes its own copy.
+    '''
+    
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                expire, val = self.data[key]
+            except KeyError:
+                return default
+            if expire < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return val
+    
+    def set(self, key, val, ttl=None):
+        if ttl is None or ttl < 0 or ttl > self.ttl:
+            ttl = self.ttl
+        with self.lock:
+            self.data[key] = (time.monotonic() + ttl, val)
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+    
+    def resize(self, size, ttl):
+        '''Apply new limits, keeping the entries which still fit.'''
+        with self.lock:
+            self.size = size
+            self.ttl = ttl
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+    
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
 class Cache:
+    '''
+    Values in redis with an in-process LRU cache in front.
+    Writes are announced on a redis channel, so that other processes drop their local copies.
+    '''
+    
     source = None
+    codec = 'pickle'
+    async_source = None
+    server = None
+    local = None
+    channel = 'cache.invalidate'
+    origin = f'{os.getpid()}.{uuid.uuid4().hex[:8]}'
+    listeners: Dict[str, List[weakref.ref]] = {}
+    pubsub = None
     
     def __init__(self, base=None):
         self._base = base
@@ -24,19 +135,105 @@ class Cache:
         else:
             return None
     
+    @classmethod
+    def client(cls):
+        if not cls.source:
+            cls.refresh()
+        return cls.source
+    
+    @classmethod
+    def async_client(cls):
+        '''Get the async client, which shares a connection pool and the data of the sync client.'''
+        if not Cache.source:
+            Cache.refresh()
+        if not Cache.async_source:
+            if Cache.server:
+                Cache.async_source = fakeredis.FakeAsyncRedis(server=Cache.server)
+            else:
+                redis_conf = config.get('redis', {})
+                Cache.async_source = redis.asyncio.Redis(
+                    connection_pool = redis.asyncio.ConnectionPool(
+                        host = redis_conf.get('host', 'localhost'),
+                        port = int(redis_conf.get('port', 6379)),
+                        db = int(redis_conf.get('db', 0)),
+                        password = redis_conf.get('password', None),
+                        max_connections = config.get('cache.pool_size', 32),
+                    )
+                )
+        return Cache.async_source
+    
     @classmethod
     def refresh(cls):
         redis_conf = config.get('redis', None)
+        Cache.local = LocalCache(
+            size = config.snapshot.cache_local_size,
+            ttl = config.snapshot.cache_local_ttl,
+        )
+        Cache.async_source = None
+        Cache.codec = config.get('cache.codec', 'pickle')
+        if Cache.codec not in Codec.codecs:
+            logger.warning(f'Cache codec "{Cache.codec}" is not available, and pickle is used instead.')
+            Cache.codec = 'pickle'
         if not redis_conf:
             logger.warning('Redis is not configured, and caches will be lost during program restart.')
-            cls.source = fakeredis.FakeStrictRedis()
+            Cache.server = fakeredis.FakeServer()
+            Cache.source = fakeredis.FakeStrictRedis(server=Cache.server)
         else:
-            cls.source = redis.StrictRedis(
+            Cache.server = None
+            Cache.source = redis.StrictRedis(
                 host = redis_conf.get('host', 'localhost'),
                 port = int(redis_conf.get('port', 6379)),
                 db = int(redis_conf.get('db', 0)),
                 password = redis_conf.get('password', None),
             )
+            Cache.subscribe()
+    
+    @classmethod
+    def on_config(cls, settings):
+        if Cache.local:
+            Cache.local.resize(settings.cache_local_size, settings.cache_local_ttl)
+    
+    @classmethod
+    def subscribe(cls):
+        '''Listen for writes of other processes in a thread, and drop local copies of written keys.'''
+        if Cache.pubsub:
+            Cache.pubsub.stop()
+        pubsub = Cache.source.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{Cache.channel: Cache.on_invalidate})
+        Cache.pubsub = pubsub.run_in_thread(sleep_time=1, daemon=True)
+    
+    @classmethod
+    def on_invalidate(cls, message):
+        origin, _, path = message['data'].decode().partition(':')
+        if origin == cls.origin:
+            return
+        cls.local.pop(path)
+        for ref in list(cls.listeners.get(path, ())):
+            listener = ref()
+            if listener is not None:
+                listener.invalidate()
+    
+    @classmethod
+    def listen(cls, path, listener):
+        '''Call listener.invalidate() when the value at path is written by another process.'''
+        cls.listeners.setdefault(path, []).append(weakref.ref(listener, lambda ref: cls.forget(path, ref)))
+    
+    @classmethod
+    def forget(cls, path, ref):
+        refs = cls.listeners.get(path, [])
+        try:
+            refs.remove(ref)
+        except ValueError:
+            pass
+        if not refs:
+            cls.listeners.pop(path, None)
+    
+    @classmethod
+    def publish(cls, path):
+        if not cls.source:
+            cls.refresh()
+        if cls.pubsub:
+            cls.source.publish(cls.channel, f'{cls.origin}:{path}')
     
     def __getitem__(self, key):
         return self.get(key)
@@ -57,34 +254,59 @@ class Cache:
     
     def get(self, key=None, default=Def):
         if not self.source:
-            self.__class__.refresh()
+            Cache.refresh()
+        path = self.get_path(key)
+        pval = self.local.get(path, Def)
+        if pval is not Def:
+            return self.loads(pval)
         try:
-            pval = self.source[self.get_path(key)]
+            pval = self.source[path]
         except KeyError:
             if default is Def:
                 raise
             else:
                 return default
-                
+        self.local.set(path, pval)
+        return self.loads(pval)
+    
+    @staticmethod
+    def loads(pval):
         if isinstance(pval, bytes):
             try:
-                val = dill.loads(pval)
-            except dill.UnpicklingError:
+                return Codec.loads(pval)
+            except Exception:
                 pass
-        return val
+            try:
+                return int(pval)
+            except ValueError:
+                return pval.decode()
+        return pval
+    
+    @classmethod
+    def dumps(cls, val):
+        if not isinstance(val, (int, str)):
+            return Codec.dumps(val, cls.codec)
+        else:
+            return val
         
-    def set(self, key=None, val=Def, ttl=None):
+    def set(self, key=None, val=Def, ttl=None, local=True):
+        '''Write a value, which is also kept in the local cache unless local is False.'''
         if not self.source:
-            self.__class__.refresh()
+            Cache.refresh()
         if val is Def:
             raise ValueError('value must be provided')
-        if not isinstance(val, (int, str)):
-            pval = dill.dumps(val)
-        else:
-            pval = val
+        pval = self.dumps(val)
+        path = self.get_path(key)
         if ttl is not None and ttl < 0:
-            ttl = self.source.ttl(self.get_path(key))
-        self.source.set(self.get_path(key), pval, ex=ttl)
+            ttl = self.source.ttl(path)
+            if ttl < 0:
+                ttl = None
+        self.source.set(path, pval, ex=ttl)
+        if local:
+            self.local.set(path, pval, ttl=ttl)
+        else:
+            self.local.pop(path)
+        self.publish(path)
     
 class CacheDict(ProxyBase):
     __noproxy__ = ("_cache", "_path", "_default")
@@ -93,6 +315,7 @@ class CacheDict(ProxyBase):
         self._cache = None
         self._path = path
         self._default = default
+        Cache.listen(path, self)
         
     @property
     def __subject__(self):
@@ -106,6 +329,9 @@ class CacheDict(ProxyBase):
     def save(self, ttl=None):
         self.reload(force=False)
         Cache(self._path).set(val=self._cache, ttl=ttl)
+    
+    def invalidate(self):
+        self._cache = None
         
 class CacheQueue(ProxyBase):
     __noproxy__ = ("_cache", "_list", "_path")
@@ -136,14 +362,239 @@ class CacheQueue(ProxyBase):
         self.reload(force=False)
         item = await self._cache.get()
         self._list.remove(item)
-        Cache(self._path).set(val=self.save_hook(self._list))
+        Cache(self._path).set(val=self.save_hook(self._list), local=False)
         return item
     
     async def put(self, item):
         self.reload(force=False)
         self._list.append(item)
-        Cache(self._path).set(val=self.save_hook(self._list))
+        Cache(self._path).set(val=self.save_hook(self._list), local=False)
         return await self._cache.put(item)
     
     def save_hook(self, val):
-        return val
\ No newline at end of file
+        return val
+class AsyncCache(Cache):
+    '''A Cache using the async client, get, set and delete are coroutines and writes are pipelined.'''
+    
+    async def get(self, key=None, default=Def):
+        client = self.async_client()
+        path = self.get_path(key)
+        pval = self.local.get(path, Def)
+        if pval is not Def:
+            return self.loads(pval)
+        pval = await client.get(path)
+        if pval is None:
+            if default is Def:
+                raise KeyError(path)
+            else:
+                return default
+        self.local.set(path, pval)
+        return self.loads(pval)
+    
+    async def set(self, key=None, val=Def, ttl=None, local=True):
+        client = self.async_client()
+        if val is Def:
+            raise ValueError('value must be provided')
+        pval = self.dumps(val)
+        path = self.get_path(key)
+        if ttl is not None and ttl < 0:
+            ttl = await client.ttl(path)
+            if ttl < 0:
+                ttl = None
+        if local:
+            self.local.set(path, pval, ttl=ttl)
+        else:
+            self.local.pop(path)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.set(path, pval, ex=ttl)
+            if self.pubsub:
+                pipe.publish(self.channel, f'{self.origin}:{path}')
+            await pipe.execute()
+    
+    async def set_many(self, items: dict, ttl=None):
+        '''Write values of several keys in one pipeline.'''
+        client = self.async_client()
+        paths = {self.get_path(k): self.dumps(v) for k, v in items.items()}
+        async with client.pipeline(transaction=False) as pipe:
+            for path, pval in paths.items():
+                pipe.set(path, pval, ex=ttl)
+                if self.pubsub:
+                    pipe.publish(self.channel, f'{self.origin}:{path}')
+            await pipe.execute()
+        for path, pval in paths.items():
+            self.local.set(path, pval, ttl=ttl)
+    
+    async def delete(self, key=None):
+        client = self.async_client()
+        path = self.get_path(key)
+        self.local.pop(path)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.delete(path)
+            if self.pubsub:
+                pipe.publish(self.channel, f'{self.origin}:{path}')
+            await pipe.execute()
+
+class CacheHash:
+    '''A redis hash whose fields are read and written one by one, each field is serialized on its own.'''
+    
+    def __init__(self, path):
+        self._path = path
+    
+    async def get(self, field, default=Def):
+        pval = await Cache.async_client().hget(self._path, field)
+        if pval is None:
+            if default is Def:
+                raise KeyError(field)
+            else:
+                return default
+        return Cache.loads(pval)
+    
+    async def set(self, field, val):
+        await Cache.async_client().hset(self._path, field, Cache.dumps(val))
+    
+    async def update(self, mapping: dict):
+        if mapping:
+            client = Cache.async_client()
+            await client.hset(self._path, mapping={f: Cache.dumps(v) for f, v in mapping.items()})
+    
+    async def delete(self, *fields):
+        if fields:
+            return await Cache.async_client().hdel(self._path, *fields)
+        return 0
+    
+    async def contains(self, field):
+        return await Cache.async_client().hexists(self._path, field)
+    
+    async def items(self):
+        pvals = await Cache.async_client().hgetall(self._path)
+        return {f.decode(): Cache.loads(v) for f, v in pvals.items()}
+    
+    async def length(self):
+        return await Cache.async_client().hlen(self._path)
+
+class CacheCounter:
+    '''
+    Counters incremented atomically in redis, as a plain key or as fields of a hash.
+    A hash saved as a pickled dict by older versions is converted on first use.
+    '''
+    
+    def __init__(self, path, fields=()):
+        self._path = path
+        self._fields = fields
+        self._checked = False
+    
+    async def check(self):
+        if self._checked:
+            return
+        client = Cache.async_client()
+        if self._fields and await client.type(self._path) == b'string':
+            legacy = Cache.loads(await client.get(self._path))
+            await client.delete(self._path)
+            if isinstance(legacy, dict):
+                await client.hset(self._path, mapping={f: legacy[f] for f in self._fields if f in legacy})
+        self._checked = True
+    
+    async def incr(self, field=None, n=1):
+        await self.check()
+        client = Cache.async_client()
+        if field is None:
+            if isinstance(n, float):
+                return await client.incrbyfloat(self._path, n)
+            return await client.incrby(self._path, n)
+        if isinstance(n, float):
+            return await client.hincrbyfloat(self._path, field, n)
+        return await client.hincrby(self._path, field, n)
+    
+    async def incr_many(self, counts: dict):
+        '''Increment several fields of the hash in one pipeline.'''
+        await self.check()
+        async with Cache.async_client().pipeline(transaction=False) as pipe:
+            for field, n in counts.items():
+                if isinstance(n, float):
+                    pipe.hincrbyfloat(self._path, field, n)
+                else:
+                    pipe.hincrby(self._path, field, n)
+            return await pipe.execute()
+    
+    @staticmethod
+    def number(pval):
+        if pval is None:
+            return 0
+        try:
+            return int(pval)
+        except ValueError:
+            return float(pval)
+    
+    async def get(self, field=None):
+        await self.check()
+        client = Cache.async_client()
+        if field is None:
+            return self.number(await client.get(self._path))
+        return self.number(await client.hget(self._path, field))
+    
+    async def all(self):
+        await self.check()
+        pvals = await Cache.async_client().hgetall(self._path)
+        counts = {f: 0 for f in self._fields}
+        counts.update({f.decode(): self.number(v) for f, v in pvals.items()})
+        return counts
+
+class AsyncCacheDict(CacheDict):
+    '''A CacheDict loaded and saved with the async client, reload() must be awaited before it is accessed.'''
+    
+    __noproxy__ = ("_stale",)
+    
+    def __init__(self, path=None, default={}):
+        super().__init__(path, default)
+        self._stale = False
+    
+    @property
+    def __subject__(self):
+        if self._cache is None:
+            raise RuntimeError(f'cache dict "{self._path}" is used before loaded')
+        return self._cache
+    
+    async def reload(self, force=True):
+        if self._cache is None or self._stale or force:
+            self._cache = await AsyncCache(self._path).get(default=self._default)
+            self._stale = False
+    
+    async def save(self, ttl=None):
+        await self.reload(force=False)
+        await AsyncCache(self._path).set(val=self._cache, ttl=ttl)
+    
+    def invalidate(self):
+        self._stale = True
+
+class AsyncCacheQueue(CacheQueue):
+    '''A CacheQueue persisted with the async client.'''
+    
+    @property
+    def __subject__(self):
+        if self._cache is None:
+            raise RuntimeError(f'cache queue "{self._path}" is used before loaded')
+        return self._cache
+    
+    async def reload(self, force=True):
+        if self._cache is None or force:
+            items = self.load_hook(await AsyncCache(self._path).get(default=[]))
+            self._cache = asyncio.Queue()
+            self._list = []
+            for item in items:
+                self._cache.put_nowait(item)
+                self._list.append(item)
+    
+    async def get(self):
+        await self.reload(force=False)
+        item = await self._cache.get()
+        self._list.remove(item)
+        await AsyncCache(self._path).set(val=self.save_hook(self._list), local=False)
+        return item
+    
+    async def put(self, item):
+        await self.reload(force=False)
+        self._list.append(item)
+        await AsyncCache(self._path).set(val=self.save_hook(self._list), local=False)
+        return await self._cache.put(item)
+
+config.subscribe(Cache.on_config)
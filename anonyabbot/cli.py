@@ -19,7 +19,9 @@ patch_pyrogram()
 
 from .bot.pool import start as start_pool
 from .bot.father import FatherBot
-from .model import BaseModel, db
+from .model import db, shard_db
+from .keyspace import Keyspace
+from .migration import upgrade, check_query_plans, init_shard, move_to_shards
 
 
 def formatter(record):
@@ -60,14 +62,27 @@ def main(
         dir_okay=False,
         allow_dash=True,
         help="Config toml file",
-    )
+    ),
+    keyspace: bool = typer.Option(
+        False,
+        "--keyspace",
+        help="Print redis memory usage per subsystem and group, then exit",
+    ),
 ):
     config.reload_conf(config_file)
+    if keyspace:
+        result = asyncio.run(Keyspace.report(batch=config.snapshot.keyspace_batch))
+        typer.echo("\n".join(Keyspace.format(result)))
+        raise typer.Exit()
     basedir = Path(config.get("basedir", user_data_dir(__product__)))
     logger.debug(f'Now using basedir at "{basedir.absolute()}"')
     basedir.mkdir(parents=True, exist_ok=True)
     db.init(str(basedir / f"{__product__}.db"), pragmas={"journal_mode": "wal"})
-    db.create_tables(BaseModel.__subclasses__())
+    upgrade()
+    check_query_plans()
+    if config.get("storage.shard", False):
+        shard_db.enable(basedir / "shards", init=init_shard)
+        move_to_shards()
 
     async def async_main():
         await asyncio.gather(FatherBot(config["father.token"]).start(), start_pool())
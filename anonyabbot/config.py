@@ -1,9 +1,10 @@
 import asyncio
+from dataclasses import dataclass, field, fields
 import functools
 from pathlib import Path
 from threading import Thread, Event
 import time
-from typing import Union
+from typing import Callable, List, Union
 
 from box import BoxError, ConfigBox
 from loguru import logger
@@ -26,12 +27,53 @@ class ConfigChangeHandler(FileSystemEventHandler):
         logger.info(f'Config file has changed, reloading.')
         self.func()
 
+def knob(key, default):
+    return field(default=default, metadata={"key": key})
+
+@dataclass(frozen=True)
+class Settings:
+    """Typed snapshot of the tunable settings, replaced as a whole when the config file is reloaded."""
+
+    redirect_interval: float = knob("worker.redirect_interval", 1.0)
+    voice_workers: int = knob("voice.workers", 2)
+    cache_local_size: int = knob("cache.local_size", 1024)
+    cache_local_ttl: float = knob("cache.local_ttl", 60)
+    packed_redirects: bool = knob("storage.packed_redirects", False)
+    mask_namespace: str = knob("mask.namespace", "emoji")
+    retention_days: int = knob("retention.days", 0)
+    retention_interval: float = knob("retention.interval", 3600)
+    retention_chunk: int = knob("retention.chunk", 100)
+    retention_redirects: int = knob("retention.redirects", 20000)
+    inactive_interval: float = knob("inactive.interval", 3600)
+    activity_interval: float = knob("activity.interval", 60)
+    activity_hourly_days: int = knob("activity.hourly_days", 14)
+    invite_award_days: int = knob("father.invite_award_days", 180)
+    keyspace_batch: int = knob("keyspace.batch", 500)
+    startup_concurrency: int = knob("startup.concurrency", 8)
+    startup_retries: int = knob("startup.retries", 3)
+    startup_backoff: float = knob("startup.backoff", 5)
+    startup_timeout: float = knob("startup.timeout", 120)
+
+    @classmethod
+    def from_box(cls, box: ConfigBox):
+        values = {}
+        for f in fields(cls):
+            val = box.get(f.metadata["key"], None)
+            if val is not None:
+                try:
+                    values[f.name] = f.type(val)
+                except (TypeError, ValueError):
+                    logger.warning(f'Config "{f.metadata["key"]}" should be {f.type.__name__}, and default is used.')
+        return cls(**values)
+
 class Config(ProxyBase):
-    __noproxy__ = ("_conf_file", "_cache", "_observer", "__getitem__")
+    __noproxy__ = ("_conf_file", "_cache", "_snapshot", "_subscribers", "_observer", "__getitem__")
 
     def __init__(self, conf_file=None):
         self._conf_file = conf_file
         self._cache = None
+        self._snapshot = None
+        self._subscribers: List[Callable[[Settings], None]] = []
         self._observer = None
 
     @property
@@ -40,21 +82,37 @@ class Config(ProxyBase):
             self.reload_conf(conf_file=self._conf_file)
         return self._cache
 
+    @property
+    def snapshot(self) -> Settings:
+        if not self._snapshot:
+            self.reload_conf(conf_file=self._conf_file)
+        return self._snapshot
+
+    def subscribe(self, func: Callable[[Settings], None]):
+        """Call func with the new snapshot after each reload, which may run in the observer thread."""
+        self._subscribers.append(func)
+
     def reset(self):
         self._cache = None
+        self._snapshot = None
 
-    def start_observer(self, conf_file, box):
+    def start_observer(self, conf_file):
         if self._observer:
             self._observer.stop()
         self._observer = obs = Observer()
-        func = functools.partial(self.reload_conf, box = box)
+        func = functools.partial(self.on_change, conf_file)
         obs.schedule(ConfigChangeHandler(func=func), conf_file)
         obs.start()
-        
-    def reload_conf(self, conf_file=None, box=None):
-        """Load config from provided file or config.toml at cwd."""
-        if not box:
-            box = ConfigBox(DEFAULT_CONF, box_dots=True)
+
+    def on_change(self, conf_file):
+        try:
+            self.reload_conf(conf_file, observe=False)
+        except Exception as e:
+            logger.warning(f'Can not reload config file "{conf_file}", and the current config is kept: {e}')
+
+    def reload_conf(self, conf_file=None, observe=True):
+        """Load config from provided file or config.toml at cwd, and swap it in with a new snapshot."""
+        box = ConfigBox(DEFAULT_CONF, box_dots=True)
         default_conf = Path("./config.toml")
         if conf_file:
             conf_file = Path(conf_file)
@@ -71,10 +129,18 @@ class Config(ProxyBase):
                 box.merge_update(ConfigBox.from_yaml(filename=conf_file))
             else:
                 logger.warning(f'Can not load config file "{conf_file}", a yaml/toml file is required.')
-        logger.debug(f'Now using config file at "{conf_file.absolute()}".')
+        snapshot = Settings.from_box(box)
         self._conf_file = conf_file
         self._cache = box
-        self.start_observer(conf_file, box)
+        self._snapshot = snapshot
+        for func in self._subscribers:
+            try:
+                func(snapshot)
+            except Exception as e:
+                logger.opt(exception=e).warning("Config subscriber error:")
+        if conf_file and observe:
+            logger.debug(f'Now using config file at "{conf_file.absolute()}".')
+            self.start_observer(conf_file)
 
     def __getitem__(self, key):
         try:
@@ -0,0 +1,156 @@
+import re
+from typing import Dict, Optional, Tuple
+
+import redis
+
+from .cache import Cache
+
+
+class Keyspace:
+    """
+    Memory accounting of redis keys, aggregated per subsystem and per group.
+    Keys are walked with SCAN and measured with MEMORY USAGE in pipelined batches,
+    or estimated by the length of DUMP where MEMORY is not available.
+    """
+
+    subsystems = ("worker.queue", "worker.status", "unique_mask", "invite.code")
+    group_pattern = re.compile(r"^group\.([^.]+)\.(.+)$")
+    menu_pattern = re.compile(r"^([0-9a-f]{32}|user_\d+)$")
+
+    measurable = True
+
+    @classmethod
+    def classify(cls, key: str) -> Tuple[str, Optional[str]]:
+        """Get the subsystem and the group token of a key."""
+        match = cls.group_pattern.match(key)
+        if match:
+            token, rest = match.groups()
+            for s in cls.subsystems:
+                if rest == s or rest.startswith(f"{s}."):
+                    return s, token
+            return rest.split(".")[0], token
+        if cls.menu_pattern.match(key):
+            return "menu", None
+        return key.split(".")[0], None
+
+    @classmethod
+    def redact(cls, key: str):
+        """Replace the group token in a key with the bot id."""
+        match = cls.group_pattern.match(key)
+        if not match:
+            return key
+        token, rest = match.groups()
+        return f"group.{token.split(':')[0]}.{rest}"
+
+    @staticmethod
+    def _entry():
+        return {"keys": 0, "bytes": 0, "no_ttl": 0}
+
+    @classmethod
+    async def report(cls, batch: int = 500, samples: int = 10):
+        """
+        Scan all keys and return a dict of totals, "subsystems" and "groups" breakdowns, and "flagged" samples of
+        keys without TTL that should expire: menu keys, and invite codes which are used up.
+        """
+        client = Cache.async_client()
+        result = {**cls._entry(), "flagged": 0, "samples": [], "estimated": False, "subsystems": {}, "groups": {}}
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await client.scan(cursor or 0, count=batch)
+            if not keys:
+                continue
+            keys = [k.decode() for k in keys]
+            sizes, ttls = await cls._measure(client, keys)
+            if not cls.measurable:
+                result["estimated"] = True
+            flagged = await cls._flag(client, keys, ttls)
+            for key, size, ttl, flag in zip(keys, sizes, ttls, flagged):
+                if ttl == -2:
+                    continue
+                subsystem, token = cls.classify(key)
+                entries = [result, result["subsystems"].setdefault(subsystem, cls._entry())]
+                if token:
+                    entries.append(result["groups"].setdefault(token, cls._entry()))
+                for e in entries:
+                    e["keys"] += 1
+                    e["bytes"] += size
+                    if ttl == -1:
+                        e["no_ttl"] += 1
+                if flag:
+                    result["flagged"] += 1
+                    if len(result["samples"]) < samples:
+                        result["samples"].append(key)
+        return result
+
+    @classmethod
+    async def _measure(cls, client, keys):
+        if cls.measurable:
+            async with client.pipeline(transaction=False) as pipe:
+                for k in keys:
+                    pipe.memory_usage(k, samples=0)
+                    pipe.ttl(k)
+                results = await pipe.execute(raise_on_error=False)
+            error = next((r for r in results if isinstance(r, redis.ResponseError)), None)
+            if not error:
+                return [r or 0 for r in results[::2]], results[1::2]
+            if "unknown command" not in str(error):
+                raise error
+            cls.measurable = False
+        async with client.pipeline(transaction=False) as pipe:
+            for k in keys:
+                pipe.dump(k)
+                pipe.ttl(k)
+            results = await pipe.execute()
+        return [len(r) if r else 0 for r in results[::2]], results[1::2]
+
+    @classmethod
+    async def _flag(cls, client, keys, ttls):
+        flagged = [False] * len(keys)
+        invites = []
+        for i, (key, ttl) in enumerate(zip(keys, ttls)):
+            if ttl != -1:
+                continue
+            subsystem, _ = cls.classify(key)
+            if subsystem == "menu":
+                flagged[i] = True
+            elif subsystem == "invite.code":
+                invites.append(i)
+        if invites:
+            async with client.pipeline(transaction=False) as pipe:
+                for i in invites:
+                    pipe.hget(keys[i], "usage")
+                results = await pipe.execute(raise_on_error=False)
+            for i, usage in zip(invites, results):
+                if isinstance(usage, bytes) and int(usage) == 0:
+                    flagged[i] = True
+        return flagged
+
+    @staticmethod
+    def format(result: dict, names: Dict[str, str] = None, top: int = 10):
+        """Format a report as text lines, tokens are never shown and groups are labeled with names or their bot ids."""
+
+        def size(n):
+            for unit in ("B", "KB", "MB"):
+                if n < 1024:
+                    return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+                n /= 1024
+            return f"{n:.1f}GB"
+
+        def line(label, e):
+            return f"{label:<16} {e['keys']:>8} {size(e['bytes']):>9} {e['no_ttl']:>8}"
+
+        names = names or {}
+        lines = [f"{'':<16} {'keys':>8} {'memory':>9} {'no ttl':>8}", line("total", result), "", "subsystems:"]
+        for s, e in sorted(result["subsystems"].items(), key=lambda i: -i[1]["bytes"]):
+            lines.append(line(s, e))
+        groups = sorted(result["groups"].items(), key=lambda i: -i[1]["bytes"])
+        if groups:
+            lines += ["", f"groups (top {min(top, len(groups))} of {len(groups)}):"]
+            for token, e in groups[:top]:
+                lines.append(line(names.get(token, None) or token.split(":")[0], e))
+        if result["estimated"]:
+            lines += ["", "memory is estimated by serialized size."]
+        if result["flagged"]:
+            lines += ["", f"{result['flagged']} keys have no ttl but should expire, e.g.:"]
+            lines += [f"  {Keyspace.redact(k)}" for k in result["samples"]]
+        return lines
@@ -0,0 +1,277 @@
+from datetime import datetime
+from typing import Callable, Iterable, List
+
+from loguru import logger
+from peewee import BlobField, BooleanField, CharField, Database, IntegerField, TextField, Tuple
+from playhouse.migrate import SqliteMigrator, migrate
+
+from .model import (
+    db,
+    shard_db,
+    Activity,
+    ArchivedMessage,
+    BanGroup,
+    BanGroupEntry,
+    Counter,
+    Group,
+    Member,
+    MemberRole,
+    Message,
+    PMBan,
+    PMMessage,
+    RedirectedMessage,
+    RedirectIndex,
+    SearchGram,
+    User,
+    UserRole,
+    Validation,
+    ValidationRequest,
+)
+
+MODELS = [
+    Counter,
+    SearchGram,
+    User,
+    Validation,
+    ValidationRequest,
+    BanGroup,
+    BanGroupEntry,
+    Group,
+    Member,
+    Message,
+    RedirectedMessage,
+    RedirectIndex,
+    PMBan,
+    PMMessage,
+    ArchivedMessage,
+    Activity,
+]
+
+SHARDED_MODELS = [m for m in MODELS if m._meta.database is shard_db]
+
+migrations: List[Callable[[SqliteMigrator], None]] = []
+
+
+def migration(func: Callable[[SqliteMigrator], None]):
+    """Register a schema migration, migrations are applied once and in order of registration."""
+    migrations.append(func)
+    return func
+
+
+def drop_index(migrator: SqliteMigrator, table: str, name: str):
+    if table not in migrator.database.get_tables():
+        return
+    if name not in [i.name for i in migrator.database.get_indexes(table)]:
+        return
+    migrate(migrator.drop_index(table, name))
+
+
+def add_column(migrator: SqliteMigrator, table: str, name: str, field):
+    if table not in migrator.database.get_tables():
+        return
+    if name in [c.name for c in migrator.database.get_columns(table)]:
+        return
+    migrate(migrator.add_column(table, name, field))
+
+
+def add_index(migrator: SqliteMigrator, table: str, columns: Iterable[str], unique: bool = False):
+    """Add an index if the table exists and the index does not, tables created later get indexes from model meta."""
+    columns = tuple(columns)
+    if table not in migrator.database.get_tables():
+        return
+    name = "_".join((table,) + columns)
+    if name in [i.name for i in migrator.database.get_indexes(table)]:
+        return
+    migrate(migrator.add_index(table, columns, unique=unique))
+
+
+@migration
+def hot_lookup_indexes(migrator: SqliteMigrator):
+    add_index(migrator, "message", ("member_id", "mid"))
+    add_index(migrator, "message", ("group_id", "created"))
+    add_index(migrator, "message", ("group_id", "pinned", "created"))
+    add_index(migrator, "redirectedmessage", ("to_member_id", "mid"))
+    add_index(migrator, "redirectedmessage", ("message_id", "to_member_id"))
+    add_index(migrator, "pmmessage", ("to_member_id", "redirected_mid"))
+    add_index(migrator, "member", ("group_id", "user_id"))
+    add_index(migrator, "member", ("group_id", "pinned_mask"))
+    add_index(migrator, "validation", ("user_id", "role", "until"))
+
+
+@migration
+def edit_lookup_index(migrator: SqliteMigrator):
+    add_index(migrator, "message", ("group_id", "member_id", "mid"))
+    drop_index(migrator, "message", "message_member_id_mid")
+
+
+@migration
+def packed_redirects(migrator: SqliteMigrator):
+    add_column(migrator, "message", "redirects_packed", BlobField(null=True, default=None))
+
+
+@migration
+def group_retention(migrator: SqliteMigrator):
+    add_column(migrator, "group", "retention_days", IntegerField(null=True, default=None))
+
+
+@migration
+def member_sort_indexes(migrator: SqliteMigrator):
+    add_index(migrator, "member", ("group_id", "role"))
+    add_index(migrator, "member", ("group_id", "last_activity"))
+
+
+@migration
+def search_index(migrator: SqliteMigrator):
+    database = migrator.database
+    if "user" not in database.get_tables():
+        return
+    database.create_tables([SearchGram])
+    rows = []
+    for u in User.select(User.id, User.username, User.firstname, User.lastname).iterator():
+        rows.extend({"gram": g, "kind": SearchGram.USER, "ref": u.id} for g in SearchGram.grams(u.name, u.username))
+    for g in Group.select(Group.id, Group.username, Group.title).iterator():
+        rows.extend({"gram": gram, "kind": SearchGram.GROUP, "ref": g.id} for gram in SearchGram.grams(g.title, g.username))
+    for i in range(0, len(rows), 1000):
+        SearchGram.insert_many(rows[i : i + 1000]).on_conflict_ignore().execute()
+
+
+@migration
+def code_index(migrator: SqliteMigrator):
+    add_index(migrator, "validationrequest", ("code",))
+
+
+@migration
+def expiry_indexes(migrator: SqliteMigrator):
+    if "validation" in migrator.database.get_tables():
+        add_column(migrator, "validation", "expired", BooleanField(default=False))
+        Validation.update(expired=True).where(Validation.until <= datetime.now()).execute()
+        add_index(migrator, "validation", ("expired", "until"))
+    add_index(migrator, "bangroup", ("until",))
+
+
+@migration
+def mask_namespace(migrator: SqliteMigrator):
+    add_column(migrator, "group", "mask_namespace", CharField(null=True, default=None))
+    add_column(migrator, "group", "mask_alphabet", TextField(null=True, default=None))
+
+
+def upgrade(database: Database = db, models: List = MODELS):
+    """Create tables for a new database, or apply pending migrations to an existing database."""
+    latest = len(migrations)
+    if not database.get_tables():
+        database.create_tables(models)
+        database.pragma("user_version", latest)
+        return
+    version = database.pragma("user_version")
+    migrator = SqliteMigrator(database)
+    for i in range(version, latest):
+        func = migrations[i]
+        with database.atomic():
+            func(migrator)
+            database.pragma("user_version", i + 1)
+        logger.info(f"Applied database migration {i + 1}: {func.__name__}.")
+    database.create_tables(models)
+
+
+def move_group_rows(database: Database, group_id: int, chunk: int = 5000):
+    """
+    Move rows of a group from the central database into its shard, and return the number of rows moved.
+    Rows are moved in chunks, each copied with INSERT OR IGNORE and deleted from the central database in one
+    transaction, so that a move interrupted at any point is completed by running it again.
+    """
+    # Rows referring to messages are moved before the messages they are selected by.
+    filters = {
+        RedirectedMessage: "message_id IN (SELECT id FROM central.message WHERE group_id = ?)",
+        RedirectIndex: "message_id IN (SELECT id FROM central.message WHERE group_id = ?)",
+        PMMessage: 'to_member_id IN (SELECT id FROM central."member" WHERE group_id = ?)',
+        ArchivedMessage: "group_id = ?",
+        Message: "group_id = ?",
+    }
+    database.execute_sql("ATTACH DATABASE ? AS central", (db.database,))
+    try:
+        n = 0
+        for model, where in filters.items():
+            table = model._meta.table_name
+            columns = ", ".join(f'"{f.column_name}"' for f in model._meta.sorted_fields)
+            key = ", ".join(f'"{f.column_name}"' for f in model._meta.get_primary_keys())
+            keys = f'SELECT {key} FROM central."{table}" WHERE {where} ORDER BY {key} LIMIT {chunk}'
+            while True:
+                with database.atomic():
+                    database.execute_sql(
+                        f'INSERT OR IGNORE INTO main."{table}" ({columns}) '
+                        f'SELECT {columns} FROM central."{table}" WHERE ({key}) IN ({keys})',
+                        (group_id,),
+                    )
+                    moved = database.execute_sql(
+                        f'DELETE FROM central."{table}" WHERE ({key}) IN ({keys})', (group_id,)
+                    ).rowcount
+                n += moved
+                if moved < chunk:
+                    break
+        return n
+    finally:
+        database.execute_sql("DETACH DATABASE central")
+
+
+def move_to_shards(chunk: int = 5000):
+    """Move rows of all groups left in the central database into their shards, which is run before bots start."""
+    tables = {m: m._meta.table_name for m in (Message, ArchivedMessage, PMMessage, Member)}
+    cursor = db.execute_sql(
+        f'SELECT group_id FROM "{tables[Message]}" UNION SELECT group_id FROM "{tables[ArchivedMessage]}" '
+        f'UNION SELECT m.group_id FROM "{tables[PMMessage]}" p JOIN "{tables[Member]}" m ON p.to_member_id = m.id'
+    )
+    group_ids = [r[0] for r in cursor.fetchall()]
+    total = 0
+    for group_id in group_ids:
+        with shard_db.using(group_id) as database:
+            n = move_group_rows(database, group_id, chunk=chunk)
+        shard_db.close(group_id)
+        if n:
+            logger.info(f"Moved {n} rows of group {group_id} into its shard.")
+        total += n
+    if total:
+        logger.info(f"Moved {total} rows of {len(group_ids)} groups into shards.")
+
+
+def init_shard(database: Database, group_id: int, new: bool):
+    upgrade(database, SHARDED_MODELS)
+
+
+def hot_queries():
+    group = Group(id=0)
+    member = Member(id=0, group=group)
+    user = User(id=0)
+    return {
+        "message by group, member and mid": Message.select().where(Message.group == group, Message.member == member, Message.mid == 0),
+        "redirected message by member and mid": RedirectedMessage.select().where(
+            RedirectedMessage.mid == 0, RedirectedMessage.to_member == member
+        ),
+        "redirect index by member and mid": RedirectIndex.select().where(RedirectIndex.to_member == member, RedirectIndex.mid == 0),
+        "pm message by member and mid": PMMessage.select().where(PMMessage.redirected_mid == 0, PMMessage.to_member == member),
+        "member by group and user": Member.select().where(Member.group == group, Member.user == user),
+        "member by group and mask": Member.select().where(Member.group == group, Member.pinned_mask == ""),
+        "not redirected messages": member.s_not_redirected().where(Message.created >= datetime.now()).order_by(Message.created.desc()),
+        "not redirected pinned messages": member.s_not_redirected()
+        .where(Message.pinned == True, Message.created >= datetime.now())
+        .order_by(Message.created.desc()),
+        "active members": group.members.where(Member.role >= MemberRole.GUEST),
+        "members page by role": group.members.where(Member.role >= MemberRole.GUEST, Tuple(Member.role, Member.id) < Tuple(0, 0))
+        .order_by(Member.role.desc(), Member.id.desc())
+        .limit(10),
+        "validations of user": user.s_validation_for(UserRole.ADMIN),
+        "pending validation expiries": Validation.select().where(Validation.expired == False, Validation.until.is_null(False)),
+        "validation requests by code": ValidationRequest.select().where(ValidationRequest.code == ""),
+        "search grams of user": SearchGram.select().where(SearchGram.kind == SearchGram.USER, SearchGram.ref == 0),
+    }
+
+
+def check_query_plans(database: Database = db):
+    """Check with EXPLAIN QUERY PLAN that each hot query is served by an index, and return names of queries that are not."""
+    unindexed = []
+    for name, query in hot_queries().items():
+        sql, params = query.sql()
+        plan = [row[-1] for row in database.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)]
+        if any(p.startswith("SCAN") for p in plan):
+            logger.warning(f'Query "{name}" is not using an index: {"; ".join(plan)}.')
+            unindexed.append(name)
+    return unindexed
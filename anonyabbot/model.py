@@ -1,18 +1,96 @@
 from __future__ import annotations
 
+from array import array
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
+import heapq
+import json
+from pathlib import Path
 import random
 import string
-from typing import Iterable, List, Type, Union
+import sys
+import zlib
+from typing import Callable, Dict, Iterable, List, Tuple, Type, Union
 
 from aenum import IntEnum
 from peewee import *
+from playhouse.shortcuts import model_to_dict
+from thefuzz import fuzz
 
+from .cache import Cache
+from .config import config
 from .utils import to_iterable, extract
 
 db = SqliteDatabase(None)
 
 
+class ShardRouter:
+    """
+    Route queries of per-group models to the database file of the group bound in the current context.
+    The default database is used when sharding is not enabled or no group is bound.
+    """
+
+    def __init__(self, default: Database):
+        self.default = default
+        self.path: Path = None
+        self.init: Callable[[Database, int, bool], None] = None
+        self.shards: Dict[int, Database] = {}
+        self.group: ContextVar[int] = ContextVar("shard_group", default=None)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def enable(self, path: Path, init: Callable[[Database, int, bool], None] = None):
+        """Store per-group tables in "<path>/<group id>.db", init is called with (database, group id, is new) on first open."""
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.init = init
+
+    def bind(self, group_id: int):
+        return self.group.set(group_id)
+
+    @contextmanager
+    def using(self, group_id: int):
+        token = self.group.set(group_id)
+        try:
+            yield self.current()
+        finally:
+            self.group.reset(token)
+
+    def current(self) -> Database:
+        group_id = self.group.get()
+        if group_id is None or not self.enabled:
+            return self.default
+        database = self.shards.get(group_id, None)
+        if database is None:
+            database = self.open(group_id)
+        return database
+
+    def open(self, group_id: int):
+        file = self.path / f"{group_id}.db"
+        new = not file.exists()
+        database = SqliteDatabase(str(file), pragmas={"journal_mode": "wal"})
+        self.shards[group_id] = database
+        if self.init:
+            with self.using(group_id):
+                self.init(database, group_id, new)
+        return database
+
+    def close(self, group_id: int):
+        """Close the database file of a group, which is opened again on next use."""
+        database = self.shards.pop(group_id, None)
+        if database is not None:
+            database.close()
+
+    def __getattr__(self, attr):
+        return getattr(self.current(), attr)
+
+
+shard_db = ShardRouter(db)
+
+
 class OperationError(Exception):
     pass
 
@@ -111,6 +189,108 @@ class BaseModel(Model):
         database = db
 
 
+class ShardedModel(BaseModel):
+    """Models with high volume per-group tables, which are stored in the shard of the group when sharding is enabled."""
+
+    class Meta:
+        database = shard_db
+
+
+class Counter(BaseModel):
+    key = CharField(primary_key=True)
+    value = IntegerField(default=0)
+
+    @classmethod
+    def read(cls, key: str, compute: Callable[[], int]) -> int:
+        """Read a counter, which is computed once by calling compute when it does not exist yet."""
+        value = cls.select(cls.value).where(cls.key == key).scalar()
+        if value is None:
+            value = compute()
+            cls.insert(key=key, value=value).on_conflict_replace().execute()
+        return value
+
+    @classmethod
+    def incr(cls, keys: Union[str, Iterable[str]], n: int = 1):
+        """Increment existing counters, counters not read yet are left to be computed on first read."""
+        keys = list(to_iterable(keys))
+        if keys and n:
+            cls.update(value=cls.value + n).where(cls.key << keys).execute()
+
+
+class SearchGram(BaseModel):
+    """Bigram index of names of users and groups, used to prefilter candidates of fuzzy search."""
+
+    USER = 1
+    GROUP = 2
+
+    gram = CharField()
+    kind = IntegerField()
+    ref = IntegerField()
+
+    class Meta:
+        primary_key = CompositeKey("gram", "kind", "ref")
+        without_rowid = True
+        indexes = ((("kind", "ref"), False),)
+
+    @staticmethod
+    def grams(*texts: str):
+        grams = set()
+        for text in texts:
+            if not text:
+                continue
+            text = " ".join(text.lower().split())
+            if len(text) == 1:
+                grams.add(text)
+            grams.update(text[i : i + 2] for i in range(len(text) - 1))
+        return grams
+
+    @classmethod
+    def index(cls, kind: int, ref: int, *texts: str):
+        """Update grams of a user or group to the grams of texts, only changed grams are written."""
+        grams = cls.grams(*texts)
+        current = {g.gram for g in cls.select(cls.gram).where(cls.kind == kind, cls.ref == ref)}
+        removed = current - grams
+        added = grams - current
+        if removed:
+            cls.delete().where(cls.kind == kind, cls.ref == ref, cls.gram << list(removed)).execute()
+        if added:
+            cls.insert_many([{"gram": g, "kind": kind, "ref": ref} for g in added]).on_conflict_ignore().execute()
+
+    @classmethod
+    def candidates(cls, kind: int, query: str, within: Select = None, limit: int = 200) -> List[int]:
+        """
+        Get ids sharing the most grams with the query, which have at least half of the grams of the query.
+        Single character queries match grams starting with the character.
+        """
+        grams = cls.grams(query)
+        if not grams:
+            return []
+        if len(grams) == 1 and len(next(iter(grams))) == 1:
+            c = next(iter(grams))
+            query = cls.select(cls.ref).where(cls.kind == kind, cls.gram >= c, cls.gram < c + "\U0010ffff")
+            if within is not None:
+                query = query.where(cls.ref << within)
+            return list(dict.fromkeys(r.ref for r in query.limit(limit * 4)))[:limit]
+        hits = fn.COUNT(cls.gram)
+        query = cls.select(cls.ref).where(cls.kind == kind, cls.gram << list(grams))
+        if within is not None:
+            query = query.where(cls.ref << within)
+        # group by an expression so that grams are looked up by primary key instead of scanning the (kind, ref) index
+        query = query.group_by(cls.ref + 0).having(hits >= max(1, len(grams) // 2)).order_by(hits.desc()).limit(limit)
+        return [r.ref for r in query]
+
+    @staticmethod
+    def rank(query: str, items: Iterable[Tuple[object, Iterable[str]]], limit: int = 20, cutoff: int = 50):
+        """Rank (item, texts) pairs by the best fuzzy score of their texts against the query."""
+        scored = []
+        for item, texts in items:
+            score = max((fuzz.WRatio(query, t) for t in texts if t), default=0)
+            if score >= cutoff:
+                scored.append((score, item))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [item for _, item in scored[:limit]]
+
+
 class User(BaseModel):
     id = AutoField()
     uid = IntegerField(unique=True)
@@ -119,6 +299,30 @@ class User(BaseModel):
     lastname = CharField(index=True, null=True)
     created = DateTimeField(default=datetime.now)
 
+    @classmethod
+    def n_users(cls):
+        return Counter.read("users", lambda: cls.select().count())
+
+    def save(self, *args, **kw):
+        with db.atomic():
+            new = self.id is None
+            renamed = {"username", "firstname", "lastname"} & self._dirty
+            result = super().save(*args, **kw)
+            if new:
+                Counter.incr("users")
+            if new or renamed:
+                SearchGram.index(SearchGram.USER, self.id, self.name, self.username)
+        return result
+
+    @classmethod
+    def search(cls, query: str, within: Select = None, limit: int = 20) -> List[User]:
+        """Fuzzy search users by name and username, optionally within a query selecting user ids."""
+        ids = SearchGram.candidates(SearchGram.USER, query, within=within)
+        if not ids:
+            return []
+        users = cls.select().where(cls.id << ids)
+        return SearchGram.rank(query, ((u, (u.name, u.username)) for u in users), limit=limit)
+
     @property
     def name(self):
         return " ".join([n for n in (self.firstname, self.lastname) if n])
@@ -163,7 +367,7 @@ class User(BaseModel):
         return (
             cls.select()
             .join(Validation)
-            .where(Validation.role << to_iterable(roles), (Validation.until > datetime.now()) | (Validation.until.is_null()))
+            .where(Validation.role << to_iterable(roles), Validation.expired == False)
         )
 
     @classmethod
@@ -187,11 +391,9 @@ class User(BaseModel):
 
     def s_validation_for(self, roles: Iterable[UserRole] = None):
         if roles is not None:
-            return self.validations.where(
-                Validation.role << to_iterable(roles), (Validation.until > datetime.now()) | (Validation.until.is_null())
-            )
+            return self.validations.where(Validation.role << to_iterable(roles), Validation.expired == False)
         else:
-            return self.validations.where((Validation.until > datetime.now()) | (Validation.until.is_null()))
+            return self.validations.where(Validation.expired == False)
 
     def add_validation(
         self,
@@ -224,6 +426,7 @@ class User(BaseModel):
             v: Validation
             for v in self.s_validation_for(roles).iterator():
                 v.until = datetime.now()
+                v.expired = True
                 v.save()
                 count += 1
         return count
@@ -235,15 +438,21 @@ class User(BaseModel):
         length: int = 16,
         num: int = 1,
     ) -> Union[List[str], str]:
-        codes = []
+        """Create num unique codes for roles, which are checked against existing codes and written in chunks."""
+        chars = [s for s in string.digits if not s == "0"] + [s for s in string.ascii_uppercase if not s == "O"]
+        roles = list(to_iterable(roles))
+        codes = set()
         with db.atomic():
-            for _ in range(num):
-                digits = [s for s in string.digits if not s == "0"]
-                asciis = [s for s in string.ascii_uppercase if not s == "O"]
-                code = "".join(random.choices(digits + asciis, k=length))
-                for r in to_iterable(roles):
-                    ValidationRequest.create(code=code, role=r, days=days, created_by=self)
-                codes.append(code)
+            while len(codes) < num:
+                batch = {"".join(random.choices(chars, k=length)) for _ in range(num - len(codes))} - codes
+                for chunk in chunked(list(batch), 500):
+                    used = ValidationRequest.select(ValidationRequest.code).where(ValidationRequest.code << chunk)
+                    batch -= {vr.code for vr in used}
+                codes |= batch
+            codes = list(codes)
+            rows = ({"code": c, "role": r, "days": days, "created_by": self} for c in codes for r in roles)
+            for chunk in chunked(rows, 500):
+                ValidationRequest.insert_many(chunk).execute()
         return extract(codes)
 
     def create_request(self, roles: Iterable[UserRole], days: int = None) -> Union[List[ValidationRequest], ValidationRequest]:
@@ -278,7 +487,7 @@ class User(BaseModel):
         return used
 
     def member_in(self, group: Group):
-        return self.member_profiles.join(Group).where(Group.id == group.id).get_or_none()
+        return Member.get_or_none(Member.group == group.id, Member.user == self.id)
 
     def groups(self, allow_disabled=False, created=False):
         mp: Member
@@ -311,8 +520,21 @@ class Validation(BaseModel):
     user = ForeignKeyField(User, backref="validations")
     role = EnumField(UserRole, default=UserRole.NONE)
     until = DateTimeField(default=datetime.now, null=True)
+    expired = BooleanField(default=False)
     created = DateTimeField(default=datetime.now)
 
+    class Meta:
+        indexes = (
+            (("user", "role", "until"), False),
+            (("expired", "until"), False),
+        )
+
+    def save(self, *args, **kw):
+        result = super().save(*args, **kw)
+        if self.until and not self.expired:
+            Expiry.push(self.until, Expiry.VALIDATION, self.id)
+        return result
+
     @property
     def by(self):
         results = set()
@@ -324,7 +546,7 @@ class Validation(BaseModel):
 
 class ValidationRequest(BaseModel):
     id = AutoField()
-    code = CharField(null=True)
+    code = CharField(null=True, index=True)
     role = EnumField(UserRole, default=UserRole.NONE)
     days = IntegerField(null=True)
     created = DateTimeField(default=datetime.now)
@@ -332,13 +554,57 @@ class ValidationRequest(BaseModel):
     used = ForeignKeyField(Validation, backref="requests", null=True, default=None)
 
 
+class CompiledBans(dict):
+    """Compiled bans by ban group id, which are all dropped when another process changes a ban group."""
+
+    path = "bangroup.compiled"
+
+    def invalidate(self):
+        self.clear()
+
+
 class BanGroup(BaseModel):
     id = AutoField()
     created = DateTimeField(default=datetime.now)
-    until = DateTimeField(default=datetime.now, null=True)
+    until = DateTimeField(default=datetime.now, null=True, index=True)
 
     default_types = [BanType.MASK_STR, BanType.INVITE]
 
+    _compiled: Dict[int, Tuple[int, datetime]] = CompiledBans()
+
+    @staticmethod
+    def bit(type: BanType):
+        return 1 << type.value
+
+    @classmethod
+    def compiled(cls, id: int) -> Tuple[int, datetime]:
+        """
+        Get the ban bitmask and until of a ban group by id, which is cached after the first lookup.
+        A deleted ban group, such as an expired one still referenced by a member, bans nothing.
+        """
+        try:
+            return cls._compiled[id]
+        except KeyError:
+            pass
+        group: BanGroup = cls.get_or_none(id=id)
+        if not group:
+            cls._compiled[id] = result = (0, None)
+            return result
+        mask = 0
+        e: BanGroupEntry
+        for e in group.entries.iterator():
+            mask |= cls.bit(e.type)
+        cls._compiled[id] = result = (mask, group.until)
+        return result
+
+    @classmethod
+    def invalidate(cls, *ids: int):
+        """Drop compiled bans of ban groups, other processes are told through cache invalidation."""
+        for id in ids:
+            cls._compiled.pop(id, None)
+        if ids:
+            Cache.publish(CompiledBans.path)
+
     @classmethod
     def generate(cls, types: List[BanType] = None, until: datetime = None):
         if types is None:
@@ -347,8 +613,29 @@ class BanGroup(BaseModel):
             group = cls.create(until=until)
             for t in to_iterable(types):
                 BanGroupEntry.create(type=t, group=group)
+        cls.invalidate(group.id)
+        if until:
+            Expiry.push(until, Expiry.BAN, group.id)
         return group
 
+    @staticmethod
+    def active(until: datetime):
+        return until is None or until > datetime.now()
+
+    def delete_instance(self, *args, **kw):
+        result = super().delete_instance(*args, **kw)
+        self.invalidate(self.id)
+        return result
+
+    def bans(self):
+        mask, _ = self.compiled(self.id)
+        for t in BanType:
+            if mask & self.bit(t):
+                yield t
+
+
+Cache.listen(CompiledBans.path, BanGroup._compiled)
+
 
 class BanGroupEntry(BaseModel):
     id = AutoField()
@@ -356,6 +643,78 @@ class BanGroupEntry(BaseModel):
     group = ForeignKeyField(BanGroup, backref="entries")
 
 
+class Expiry:
+    """
+    Scheduler of timed validations and member bans, kept as a heap ordered by expiry time.
+    The heap is loaded from the until indexes once, and new expiries are pushed as they are saved.
+    Entries are checked against the database when they are due, so outdated entries are harmless.
+    """
+
+    VALIDATION = 1
+    BAN = 2
+
+    heap: List[Tuple[datetime, int, int]] = []
+    loaded = False
+    notify: Callable[[], None] = None
+
+    @classmethod
+    def load(cls):
+        heap = [
+            (v.until, cls.VALIDATION, v.id)
+            for v in Validation.select(Validation.id, Validation.until)
+            .where(Validation.expired == False, Validation.until.is_null(False))
+            .iterator()
+        ]
+        bans = BanGroup.select(BanGroup.id, BanGroup.until).where(BanGroup.until.is_null(False))
+        heap.extend((g.until, cls.BAN, g.id) for g in bans.iterator())
+        heapq.heapify(heap)
+        cls.heap = heap
+        cls.loaded = True
+        return len(heap)
+
+    @classmethod
+    def push(cls, until: datetime, kind: int, id: int):
+        if not cls.loaded:
+            return
+        wake = not cls.heap or until < cls.heap[0][0]
+        heapq.heappush(cls.heap, (until, kind, id))
+        if wake and cls.notify:
+            cls.notify()
+
+    @classmethod
+    def delay(cls):
+        """Seconds until the next expiry, or None if nothing is scheduled."""
+        if not cls.heap:
+            return None
+        return max(0, (cls.heap[0][0] - datetime.now()).total_seconds())
+
+    @classmethod
+    def run(cls):
+        """Lift all due validations and bans in bulk, and return the number lifted."""
+        now = datetime.now()
+        due = {cls.VALIDATION: set(), cls.BAN: set()}
+        while cls.heap and cls.heap[0][0] <= now:
+            _, kind, id = heapq.heappop(cls.heap)
+            due[kind].add(id)
+        n = 0
+        with db.atomic():
+            for ids in chunked(due[cls.VALIDATION], 500):
+                query = Validation.update(expired=True).where(
+                    Validation.id << ids, Validation.until <= now, Validation.expired == False
+                )
+                n += query.execute()
+            for ids in chunked(due[cls.BAN], 500):
+                ids = [g.id for g in BanGroup.select(BanGroup.id).where(BanGroup.id << ids, BanGroup.until <= now)]
+                if not ids:
+                    continue
+                n += Member.update(ban_group=None).where(Member.ban_group << ids).execute()
+                defaults = Group.select(Group.default_ban_group).where(Group.default_ban_group << ids)
+                BanGroupEntry.delete().where(BanGroupEntry.group << ids, ~(BanGroupEntry.group << defaults)).execute()
+                BanGroup.delete().where(BanGroup.id << ids, ~(BanGroup.id << defaults)).execute()
+                BanGroup.invalidate(*ids)
+        return n
+
+
 class Group(BaseModel):
     id = AutoField()
     uid = IntegerField(index=True)
@@ -374,48 +733,131 @@ class Group(BaseModel):
     parent = ForeignKeyField('self', backref="subgroups", null=True, default=None)
     password = TextField(null=True, default=None)
     inactive_leave = IntegerField(default=0)
+    retention_days = IntegerField(null=True, default=None)
+    mask_namespace = CharField(null=True, default=None)
+    mask_alphabet = TextField(null=True, default=None)
     private = BooleanField(default=False)
     disabled = BooleanField(default=False)
 
     @property
     def n_members(self):
-        return self.members.where(Member.role >= MemberRole.GUEST).count()
+        return Counter.read(f"group.{self.id}.members", lambda: self.s_all_has_role(MemberRole.GUEST).count())
+
+    @property
+    def n_full_members(self):
+        return Counter.read(f"group.{self.id}.full_members", lambda: self.s_all_has_role(MemberRole.MEMBER).count())
     
     @property
     def n_members_all(self):
         if self.parent:
             return self.parent.n_members_all
         else:
-            return self.members.where(Member.role >= MemberRole.GUEST).count()
+            return self.n_members
     
+    @classmethod
+    def s_with_n_members(cls):
+        """Select groups with number of members as "num_members" from counters, counters not read yet are computed first."""
+        on = Counter.key == fn.printf("group.%d.members", cls.id)
+        for g in cls.select(cls.id).join(Counter, JOIN.LEFT_OUTER, on=on).where(Counter.key.is_null()):
+            g.n_members
+        return cls.select(cls, Counter.value.alias("num_members")).join(Counter, on=on).objects()
+
+    @classmethod
+    def n_groups(cls):
+        return Counter.read("groups", lambda: cls.select().where(~(cls.disabled)).count())
+
+    @classmethod
+    def n_active_groups(cls, days: int = 7):
+        """
+        Number of groups not disabled and active in last days, which is counted once a day and maintained as groups
+        become active or are disabled, groups getting inactive are only left out at the next count.
+        """
+        key = cls.active_key(days)
+
+        def compute():
+            Counter.delete().where(Counter.key % f"groups.active.{days}.*", Counter.key != key).execute()
+            since = datetime.now() - timedelta(days=days)
+            return cls.select().where(~(cls.disabled), cls.last_activity >= since).count()
+
+        return Counter.read(key, compute)
+
+    @staticmethod
+    def active_key(days: int = 7):
+        return f"groups.active.{days}.{datetime.now().date().isoformat()}"
+
     @classmethod
     def get_avg_n_members(cls):
-        query = (
-            Member
-            .select(Member.group, fn.COUNT(Member.id).alias('count'))
-            .where(Member.role >= MemberRole.GUEST)
-            .group_by(Member.group)
+        """Average number of members of groups having members, read from member counters in one query."""
+        key = Value("group.").concat(cls.id).concat(".members")
+        for g in cls.select(cls.id).where(~fn.EXISTS(Counter.select().where(Counter.key == key))):
+            g.n_members
+        average = (
+            Counter.select(fn.AVG(Counter.value)).where(Counter.key % "group.*.members", Counter.value > 0).scalar()
         )
-
-        try:
-            average = sum(q.count for q in query) / len(query)
-        except ZeroDivisionError:
-            return 0
-        else:
-            return average
+        return average or 0
 
     @property
     def n_messages(self):
-        return self.messages.count()
+        def compute():
+            with shard_db.using(self.id):
+                return self.messages.count()
+
+        return Counter.read(f"group.{self.id}.messages", compute)
+
+    def save(self, *args, **kw):
+        with db.atomic():
+            if self.id is None:
+                before = False
+            elif "disabled" in self._dirty:
+                before = not Group.select(Group.disabled).where(Group.id == self.id).scalar()
+            else:
+                before = None
+            new = self.id is None
+            renamed = {"username", "title"} & self._dirty
+            result = super().save(*args, **kw)
+            after = not self.disabled
+            if before is not None and before != after:
+                Counter.incr("groups", 1 if after else -1)
+                if self.last_activity >= datetime.now() - timedelta(days=7):
+                    Counter.incr(self.active_key(), 1 if after else -1)
+            if new or renamed:
+                SearchGram.index(SearchGram.GROUP, self.id, self.title, self.username)
+        return result
+
+    @classmethod
+    def search(cls, query: str, limit: int = 20) -> List[Group]:
+        """Fuzzy search groups by title and username."""
+        ids = SearchGram.candidates(SearchGram.GROUP, query)
+        if not ids:
+            return []
+        groups = cls.select().where(cls.id << ids)
+        return SearchGram.rank(query, ((g, (g.title, g.username)) for g in groups), limit=limit)
     
     @property
     def is_prime(self):
         return self.creator.is_prime
 
+    @property
+    def retention(self):
+        """Days to keep messages for, 0 means forever."""
+        if self.retention_days is None:
+            return config.snapshot.retention_days
+        else:
+            return self.retention_days
+
+    @property
+    def mask_mode(self):
+        """Namespace to allocate masks from, which is one of "emoji", "emoji_pair", "emoji_digit" and "custom"."""
+        if self.mask_namespace is None:
+            return config.snapshot.mask_namespace
+        else:
+            return self.mask_namespace
+
     def default_bans(self):
-        e: BanType
-        for e in self.default_ban_group.entries.iterator():
-            yield e.type
+        mask, _ = BanGroup.compiled(self.default_ban_group_id)
+        for t in BanType:
+            if mask & BanGroup.bit(t):
+                yield t
 
     def s_all_has_role(self, role: MemberRole):
         return self.members.where(Member.role >= role, Member.role >= MemberRole.GUEST)
@@ -442,18 +884,44 @@ class Group(BaseModel):
         else:
             member_ids = [m.id for m in to_iterable(members)]
             m: Message
-            for m in self.messages.join(Member).where(Member.id << member_ids).iterator():
+            for m in self.messages.where(Message.member << member_ids).iterator():
                 yield m
 
     def touch(self):
+        last = self.last_activity
         self.last_activity = datetime.now()
         self.save()
+        if not self.disabled and last < self.last_activity - timedelta(days=7):
+            Counter.incr(self.active_key())
+
+    def sweep_inactive(self):
+        """Set members inactive for longer than inactive_leave days to left in bulk, and return the number of members."""
+        if not self.inactive_leave:
+            return 0
+        creators = User.s_all_in_role(UserRole.CREATOR).select(User.id)
+        inactive = (
+            (Member.group == self)
+            & (Member.role >= MemberRole.GUEST)
+            & (Member.role < MemberRole.ADMIN)
+            & (Member.last_activity < datetime.now() - timedelta(days=self.inactive_leave))
+            & ~(Member.user << creators)
+        )
+        with db.atomic():
+            counts = Member.select(Member.role, fn.COUNT(Member.id).alias("n")).where(inactive).group_by(Member.role)
+            counts = {r.role: r.n for r in counts}
+            if not counts:
+                return 0
+            n = Member.update(role=MemberRole.LEFT).where(inactive).execute()
+            for role, count in counts.items():
+                Counter.incr(Member(group=self, role=role).counters(), -count)
+            Activity.record(self.id, leaves=n)
+        return n
 
     def cannot(self, ban: BanType, fail=False):
-        group_scope: BanGroupEntry = self.default_ban_group.entries.where(BanGroupEntry.type == ban).get_or_none()
-        if group_scope:
+        mask, until = BanGroup.compiled(self.default_ban_group_id)
+        if mask & BanGroup.bit(ban) and BanGroup.active(until):
             if fail:
-                raise BanError(type=ban, member=False, until=self.default_ban_group.until)
+                raise BanError(type=ban, member=False, until=until)
             return True
         return False
 
@@ -469,7 +937,14 @@ class Member(BaseModel):
     pinned_mask = CharField(null=True, default=None)
     invitor = ForeignKeyField('self', backref="invitees", null=True, default=None)
     ban_group = ForeignKeyField(BanGroup, backref="linked_members", null=True)
-    
+
+    class Meta:
+        indexes = (
+            (("group", "user"), False),
+            (("group", "pinned_mask"), False),
+            (("group", "role"), False),
+            (("group", "last_activity"), False),
+        )
 
     @property
     def is_banned(self):
@@ -477,7 +952,38 @@ class Member(BaseModel):
 
     @property
     def n_messages(self):
-        return self.messages.count()
+        with shard_db.using(self.group_id):
+            return self.messages.count()
+
+    def counters(self, role: MemberRole = None):
+        """Keys of the counters of the group this member is counted in with a role."""
+        role = self.role if role is None else role
+        keys = set()
+        if role >= MemberRole.GUEST:
+            keys.add(f"group.{self.group_id}.members")
+        if role >= MemberRole.MEMBER:
+            keys.add(f"group.{self.group_id}.full_members")
+        return keys
+
+    def save(self, *args, **kw):
+        with db.atomic():
+            if self.id is None:
+                before = set()
+            elif "role" in self._dirty:
+                before = self.counters(MemberRole(Member.select(Member.role).where(Member.id == self.id).scalar()))
+            else:
+                before = None
+            result = super().save(*args, **kw)
+            if before is not None:
+                after = self.counters()
+                Counter.incr(after - before, 1)
+                Counter.incr(before - after, -1)
+                key = f"group.{self.group_id}.members"
+                if key in after and key not in before:
+                    Activity.record(self.group_id, joins=1)
+                elif key in before and key not in after:
+                    Activity.record(self.group_id, leaves=1)
+        return result
 
     def touch(self):
         self.last_activity = datetime.now()
@@ -488,10 +994,6 @@ class Member(BaseModel):
         if self.user.validate(UserRole.CREATOR, fail=False):
             if current_role < MemberRole.ADMIN_ADMIN:
                 current_role = MemberRole.ADMIN_ADMIN
-        if self.group.inactive_leave:
-            if self.last_activity < datetime.now() - timedelta(days=self.group.inactive_leave):
-                if current_role < MemberRole.ADMIN:
-                    current_role = MemberRole.LEFT
         if not reversed:
             if current_role >= role:
                 return True
@@ -508,43 +1010,51 @@ class Member(BaseModel):
                 return True
 
     def check_ban(self, ban: BanType, fail=True, check_group=True):
-        if self.validate(MemberRole.ADMIN):
-            return False
-        if self.ban_group:
-            member_scope: BanGroupEntry = self.ban_group.entries.where(BanGroupEntry.type == ban).get_or_none()
-            if member_scope:
+        bit = BanGroup.bit(ban)
+        if self.ban_group_id:
+            mask, until = BanGroup.compiled(self.ban_group_id)
+            if mask & bit and BanGroup.active(until):
+                if self.validate(MemberRole.ADMIN):
+                    return False
                 if fail:
-                    raise BanError(type=ban, member=True, until=self.ban_group.until)
+                    raise BanError(type=ban, member=True, until=until)
                 return True
         if check_group:
-            group_scope: BanGroupEntry = self.group.default_ban_group.entries.where(BanGroupEntry.type == ban).get_or_none()
-            if group_scope:
+            mask, until = BanGroup.compiled(self.group.default_ban_group_id)
+            if mask & bit and BanGroup.active(until):
+                if self.validate(MemberRole.ADMIN):
+                    return False
                 if fail:
-                    raise BanError(type=ban, member=False, until=self.group.default_ban_group.until)
+                    raise BanError(type=ban, member=False, until=until)
                 return True
         return False
             
+    def s_not_redirected(self):
+        redirected = RedirectedMessage.select().where(
+            RedirectedMessage.message == Message.id,
+            RedirectedMessage.to_member == self.id,
+        )
+        indexed = RedirectIndex.select().where(
+            RedirectIndex.message == Message.id,
+            RedirectIndex.to_member == self.id,
+        )
+        return self.group.messages.where(Message.member != self.id, ~fn.EXISTS(redirected), ~fn.EXISTS(indexed))
+
     def not_redirected_messages(self, limit: int = 10, days: int = 7):
-        results = []
-        for m in self.group.messages.order_by(Message.created.desc()).iterator():
-            if m.get_redirect_for(self) is None:
-                results.append(m)
-                if len(results) >= limit:
-                    break
-                if m.created < datetime.now() - timedelta(days=days):
-                    break
-            else:
-                break
-        return results
-    
-    def not_redirected_pinned_messages(self):
-        results = []
-        for m in self.group.messages.where(Message.pinned == True).order_by(Message.created.desc()).iterator():
-            if m.get_redirect_for(self) is None:
-                results.append(m)
-            else:
-                break
-        return results
+        return list(
+            self.s_not_redirected()
+            .where(Message.created >= datetime.now() - timedelta(days=days))
+            .order_by(Message.created.desc())
+            .limit(limit)
+        )
+
+    def not_redirected_pinned_messages(self, limit: int = 10, days: int = 30):
+        return list(
+            self.s_not_redirected()
+            .where(Message.pinned == True, Message.created >= datetime.now() - timedelta(days=days))
+            .order_by(Message.created.desc())
+            .limit(limit)
+        )
     
     def s_pinned_messages(self):
         return self.group.messages.where(Message.pinned == True).order_by(Message.created.desc())
@@ -553,7 +1063,7 @@ class Member(BaseModel):
         for m in self.s_pinned_messages().iterator():
             yield m
 
-class Message(BaseModel):
+class Message(ShardedModel):
     id = AutoField()
     group = ForeignKeyField(Group, backref="messages")
     mid = IntegerField(index=True)
@@ -563,22 +1073,163 @@ class Message(BaseModel):
     pinned = BooleanField(default=False)
     updated = DateTimeField(default=datetime.now)
     created = DateTimeField(default=datetime.now)
+    redirects_packed = BlobField(null=True, default=None)
+
+    class Meta:
+        indexes = (
+            (("group", "member", "mid"), False),
+            (("group", "created"), False),
+            (("group", "pinned", "created"), False),
+        )
+
+    @classmethod
+    def n_messages(cls):
+        def compute():
+            if shard_db.enabled:
+                # Shards opened only to be counted are closed, so that a cold count does not keep every file open.
+                total = 0
+                for g in Group.select(Group.id):
+                    opened = g.id in shard_db.shards
+                    total += g.n_messages
+                    if not opened:
+                        shard_db.close(g.id)
+                return total
+            else:
+                return cls.select().count()
+
+        return Counter.read("messages", compute)
+
+    def save(self, *args, **kw):
+        new = self.id is None
+        result = super().save(*args, **kw)
+        if new:
+            Counter.incr(["messages", f"group.{self.group_id}.messages"])
+            Activity.record(self.group_id, sender=self.member_id, messages=1)
+        return result
+
+    @staticmethod
+    def use_packed():
+        return config.snapshot.packed_redirects
+
+    @staticmethod
+    def pack(redirects: Dict[int, int]):
+        """Pack a map of member id to message id into a blob of little-endian int64 pairs."""
+        a = array("q")
+        for member_id, mid in redirects.items():
+            a.append(member_id)
+            a.append(mid)
+        if sys.byteorder == "big":
+            a.byteswap()
+        return a.tobytes()
+
+    @staticmethod
+    def unpack(blob: bytes):
+        a = array("q")
+        a.frombytes(blob)
+        if sys.byteorder == "big":
+            a.byteswap()
+        return dict(zip(a[::2], a[1::2]))
+
+    def redirect_map(self, reload=False) -> Dict[int, int]:
+        """Get a map of member id to id of the redirected copy, which is cached on this instance."""
+        redirects = getattr(self, "_redirects", None)
+        if redirects is None or reload:
+            if reload:
+                self.redirects_packed = Message.select(Message.redirects_packed).where(Message.id == self.id).scalar()
+            query = RedirectedMessage.select(RedirectedMessage.to_member, RedirectedMessage.mid).where(
+                RedirectedMessage.message == self.id
+            )
+            redirects = {rm.to_member_id: rm.mid for rm in query.iterator()}
+            # Rows of both modes are merged, since packed mode may be switched while a message is being sent.
+            # The index rows are read until the message is packed, which holds all of them from then on.
+            if self.redirects_packed is not None:
+                redirects.update(self.unpack(self.redirects_packed))
+            else:
+                index = RedirectIndex.select(RedirectIndex.to_member, RedirectIndex.mid).where(
+                    RedirectIndex.message == self.id
+                )
+                redirects.update((ri.to_member_id, ri.mid) for ri in index.iterator())
+            self._redirects = redirects
+        return redirects
+
+    def add_redirects(self, redirects: Iterable[Tuple[Member, int]]):
+        """
+        Record redirected copies of this message as (member, message id) pairs.
+        In packed mode the index rows are the source of truth, and a packed message gets the pairs appended.
+        """
+        redirects = [(m.id, mid) for m, mid in redirects]
+        if not redirects:
+            return
+        with shard_db.atomic():
+            if self.use_packed():
+                RedirectIndex.insert_many(
+                    [{"to_member": m, "mid": mid, "message": self.id} for m, mid in redirects]
+                ).on_conflict_replace().execute()
+                Message.update(
+                    redirects_packed=Message.redirects_packed.concat(self.pack(dict(redirects))).cast("BLOB")
+                ).where((Message.id == self.id) & Message.redirects_packed.is_null(False)).execute()
+            else:
+                RedirectedMessage.insert_many(
+                    [{"to_member": m, "mid": mid, "message": self.id} for m, mid in redirects]
+                ).execute()
+        if getattr(self, "_redirects", None) is not None:
+            self._redirects.update(redirects)
+
+    def pack_redirects(self):
+        """Pack the index rows of this message into one blob, which is done once its broadcast is finished."""
+        if not self.use_packed():
+            return
+        with shard_db.atomic():
+            query = RedirectIndex.select(RedirectIndex.to_member, RedirectIndex.mid).where(RedirectIndex.message == self.id)
+            redirects = {ri.to_member_id: ri.mid for ri in query.iterator()}
+            if not redirects:
+                return
+            self.redirects_packed = self.pack(redirects)
+            Message.update(redirects_packed=self.redirects_packed).where(Message.id == self.id).execute()
 
     def get_redirect_for(self, member: Member):
-        if member.id == self.member.id:
+        if member.id == self.member_id:
             return self
-        else:
-            rm: RedirectedMessage = self.redirects.join(Member).where(Member.id == member.id).get_or_none()
-            return rm
+        mid = self.redirect_map().get(member.id, None)
+        if mid is None:
+            return None
+        return RedirectedMessage(mid=mid, message=self, to_member=member)
+
+    @classmethod
+    def from_redirect(cls, member: Member, mid: int):
+        """Get the original message of a redirected copy received by the member."""
+        ri: RedirectIndex = RedirectIndex.get_or_none(to_member=member, mid=mid)
+        if ri:
+            return ri.message
+        rm: RedirectedMessage = RedirectedMessage.get_or_none(to_member=member, mid=mid)
+        if rm:
+            return rm.message
 
 
-class RedirectedMessage(BaseModel):
+class RedirectedMessage(ShardedModel):
     id = AutoField()
     mid = IntegerField(index=True)
     message = ForeignKeyField(Message, backref="redirects")
     to_member = ForeignKeyField(Member, backref="redirected_messages")
     created = DateTimeField(default=datetime.now)
 
+    class Meta:
+        indexes = (
+            (("to_member", "mid"), False),
+            (("message", "to_member"), False),
+        )
+
+
+class RedirectIndex(ShardedModel):
+    to_member = ForeignKeyField(Member, index=False)
+    mid = IntegerField()
+    message = ForeignKeyField(Message, index=False)
+
+    class Meta:
+        primary_key = CompositeKey("to_member", "mid")
+        without_rowid = True
+        indexes = ((("message", "to_member"), False),)
+
 
 class PMBan(BaseModel):
     id = AutoField()
@@ -587,10 +1238,186 @@ class PMBan(BaseModel):
     created = DateTimeField(default=datetime.now)
 
 
-class PMMessage(BaseModel):
+class PMMessage(ShardedModel):
     id = AutoField()
     from_member = ForeignKeyField(Member, null=True, backref="pm_messages")
     to_member = ForeignKeyField(Member, backref="received_pm_messages")
     mid = IntegerField(index=True)
     redirected_mid = IntegerField(index=True)
-    time = DateTimeField(default=datetime.now)
\ No newline at end of file
+    time = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = ((("to_member", "redirected_mid"), False),)
+
+
+class Activity(BaseModel):
+    """Hourly and daily rollups of activity of groups."""
+
+    HOUR = 3600
+    DAY = 86400
+    FIELDS = ("messages", "deliveries", "errors", "senders", "joins", "leaves")
+
+    group = ForeignKeyField(Group, backref="activities", index=False)
+    period = IntegerField()
+    start = DateTimeField()
+    messages = IntegerField(default=0)
+    deliveries = IntegerField(default=0)
+    errors = IntegerField(default=0)
+    senders = IntegerField(default=0)
+    joins = IntegerField(default=0)
+    leaves = IntegerField(default=0)
+
+    _pending: Dict[Tuple[int, int, datetime], Dict[str, int]] = {}
+    _senders: Dict[Tuple[int, int, datetime], set] = {}
+
+    class Meta:
+        primary_key = CompositeKey("group", "period", "start")
+        without_rowid = True
+        indexes = ((("period", "start"), False),)
+
+    @classmethod
+    def bucket(cls, period: int, time: datetime = None):
+        time = time or datetime.now()
+        if period == cls.DAY:
+            return time.replace(hour=0, minute=0, second=0, microsecond=0)
+        else:
+            return time.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def record(cls, group_id: int, sender: int = None, **counts: int):
+        """
+        Buffer activity of a group into the current hourly and daily buckets, which are written on flush.
+        Senders are counted once per bucket in this process.
+        """
+        now = datetime.now()
+        for period in (cls.HOUR, cls.DAY):
+            key = (group_id, period, cls.bucket(period, now))
+            pending = cls._pending.setdefault(key, dict.fromkeys(cls.FIELDS, 0))
+            for f, n in counts.items():
+                pending[f] += n
+            if sender is not None:
+                senders = cls._senders.setdefault(key, set())
+                if sender not in senders:
+                    senders.add(sender)
+                    pending["senders"] += 1
+
+    @classmethod
+    def flush(cls):
+        """Add buffered activity to the stored buckets, and return the number of buckets written."""
+        pending, cls._pending = cls._pending, {}
+        current = {p: cls.bucket(p) for p in (cls.HOUR, cls.DAY)}
+        cls._senders = {k: v for k, v in cls._senders.items() if k[2] >= current[k[1]]}
+        if not pending:
+            return 0
+        rows = [dict(counts, group=g, period=p, start=s) for (g, p, s), counts in pending.items()]
+        update = {getattr(cls, f): getattr(cls, f) + getattr(EXCLUDED, f) for f in cls.FIELDS}
+        with db.atomic():
+            for i in range(0, len(rows), 100):
+                cls.insert_many(rows[i : i + 100]).on_conflict(
+                    conflict_target=[cls.group, cls.period, cls.start], update=update
+                ).execute()
+        return len(rows)
+
+    @classmethod
+    def prune(cls, days: int):
+        """Delete hourly buckets older than days, daily buckets are kept."""
+        return cls.delete().where(cls.period == cls.HOUR, cls.start < datetime.now() - timedelta(days=days)).execute()
+
+    @classmethod
+    def trend(cls, group: Group = None, days: int = 14, period: int = DAY):
+        """Get activity of a group, or of all groups if not specified, as a list of (start, counts) of each bucket in time order."""
+        n = days * cls.DAY // period
+        since = cls.bucket(period, datetime.now() - timedelta(seconds=period * (n - 1)))
+        fields = [fn.SUM(getattr(cls, f)).alias(f) for f in cls.FIELDS]
+        query = cls.select(cls.start, *fields).where(cls.period == period, cls.start >= since)
+        if group:
+            query = query.where(cls.group == group)
+        rows = {r.start: {f: getattr(r, f) or 0 for f in cls.FIELDS} for r in query.group_by(cls.start)}
+        buckets = [since + timedelta(seconds=period * i) for i in range(n)]
+        return [(b, rows.get(b, dict.fromkeys(cls.FIELDS, 0))) for b in buckets]
+
+
+class ArchivedMessage(ShardedModel):
+    id = AutoField()
+    group = ForeignKeyField(Group, backref="archives")
+    first = IntegerField(null=True)
+    last = IntegerField(null=True)
+    count = IntegerField(default=0)
+    data = BlobField()
+    created = DateTimeField(default=datetime.now)
+
+    @classmethod
+    def archive(cls, group: Group, before: datetime, limit: int = 100, max_redirects: int = 20000):
+        """
+        Move a chunk of messages of a group created before a time into a compressed archive.
+        A chunk holds at most limit messages, and no more redirect rows than max_redirects unless it is one message,
+        so that each chunk holds the write lock shortly also in large groups.
+        Pinned messages are kept. Replies to archived messages will be treated as not replying.
+        Private messages are kept, since they hold no content and are needed to tell replies to them from messages.
+        Returns the number of messages archived, 0 means nothing left to archive.
+        """
+        with shard_db.using(group.id), shard_db.atomic():
+            messages = list(
+                Message.select()
+                .where(Message.group == group, Message.pinned == False, Message.created < before)
+                .order_by(Message.created)
+                .limit(limit)
+            )
+            if not messages:
+                return 0
+            sizes = {}
+            for model in (RedirectedMessage, RedirectIndex):
+                query = (
+                    model.select(model.message, fn.COUNT(SQL("*")))
+                    .where(model.message << [m.id for m in messages])
+                    .group_by(model.message)
+                )
+                for message_id, n in query.tuples():
+                    sizes[message_id] = sizes.get(message_id, 0) + n
+            total = 0
+            for i, m in enumerate(messages):
+                total += sizes.get(m.id, 0)
+                if i and total > max_redirects:
+                    messages = messages[:i]
+                    break
+            ids = [m.id for m in messages]
+            redirects = cls.redirect_maps(messages)
+            data = {
+                "messages": [
+                    dict(model_to_dict(m, recurse=False, exclude=[Message.redirects_packed]), redirects=list(redirects[m.id].items()))
+                    for m in messages
+                ],
+            }
+            cls.create(
+                group=group,
+                first=min(ids),
+                last=max(ids),
+                count=len(messages),
+                data=zlib.compress(json.dumps(data, default=str).encode()),
+            )
+            Message.update(reply_to=None).where(Message.reply_to << ids).execute()
+            RedirectedMessage.delete().where(RedirectedMessage.message << ids).execute()
+            RedirectIndex.delete().where(RedirectIndex.message << ids).execute()
+            Message.delete().where(Message.id << ids).execute()
+        Counter.incr(["messages", f"group.{group.id}.messages"], -len(messages))
+        return len(messages)
+
+    @staticmethod
+    def redirect_maps(messages: List[Message]) -> Dict[int, Dict[int, int]]:
+        """Get redirect maps of messages by message id in bulk, which are read as Message.redirect_map does."""
+        redirects = {m.id: {} for m in messages}
+        query = RedirectedMessage.select(RedirectedMessage.message, RedirectedMessage.to_member, RedirectedMessage.mid)
+        for message_id, member_id, mid in query.where(RedirectedMessage.message << list(redirects)).tuples().iterator():
+            redirects[message_id][member_id] = mid
+        unpacked = [m.id for m in messages if m.redirects_packed is None]
+        if unpacked:
+            query = RedirectIndex.select(RedirectIndex.message, RedirectIndex.to_member, RedirectIndex.mid)
+            for message_id, member_id, mid in query.where(RedirectIndex.message << unpacked).tuples().iterator():
+                redirects[message_id][member_id] = mid
+        for m in messages:
+            if m.redirects_packed is not None:
+                redirects[m.id].update(Message.unpack(m.redirects_packed))
+        return redirects
+
+    def load(self):
+        return json.loads(zlib.decompress(self.data))
@@ -2,7 +2,6 @@ import asyncio
 from contextlib import asynccontextmanager
 from datetime import timedelta
 import enum
-import inspect
 import re
 from typing import Any, Coroutine, Iterable, Union
 from datetime import timedelta
@@ -185,10 +184,17 @@ class ProxyBase:
     """
     A proxy class that make accesses just like direct access to __subject__ if not overwriten in the class.
     Attributes defined in class. attrs named in __noproxy__ will not be proxied to __subject__.
+    Names in __noproxy__ of a class and its bases are collected once when the class is created.
     """
 
     __slots__ = ()
 
+    _noproxy = frozenset()
+
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+        cls._noproxy = frozenset(a for c in cls.__mro__ for a in vars(c).get("__noproxy__", ()))
+
     def __call__(self, *args, **kw):
         return self.__subject__(*args, **kw)
 
@@ -208,17 +214,8 @@ class ProxyBase:
         return oga(self, attr)
 
     def __getattr__(self, attr, oga=object.__getattribute__):
-        if attr == "hasattr" or self.hasattr(attr):
-            return oga(self, attr)
-        else:
-            return getattr(oga(self, "__subject__"), attr)
-
-    @property
-    def _noproxy(self, oga=object.__getattribute__):
-        base = oga(self, "__class__")
-        for cls in inspect.getmro(base):
-            if hasattr(cls, "__noproxy__"):
-                yield from cls.__noproxy__
+        # Only called when the attribute is not found on the proxy itself.
+        return getattr(oga(self, "__subject__"), attr)
 
     def __setattr__(self, attr, val, osa=object.__setattr__):
         if attr == "__subject__" or attr in self._noproxy:
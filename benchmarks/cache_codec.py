@@ -0,0 +1,76 @@
+"""
+Compare cache codecs on payloads the bots actually cache.
+
+Usage: python benchmarks/cache_codec.py [-n ROUNDS]
+"""
+
+import argparse
+from datetime import datetime
+import time
+
+from pyrogram.types import Chat, Message as TM, User as TU
+from pyrogram.enums import ChatType
+
+from anonyabbot.cache import Codec
+from anonyabbot.model import Group, Member, Message, User
+from anonyabbot.bot.group.worker import BroadcastOperation
+
+
+def payloads():
+    user = User(id=1, uid=10000, firstname="Alice", username="alice")
+    group = Group(id=1, uid=20000, token="0:token", username="group", title="Group", creator=user)
+    member = Member(id=1, group=group, user=user, last_mask="🐶")
+    tu = TU(id=10000, first_name="Alice", username="alice")
+    context = TM(
+        id=100,
+        from_user=tu,
+        chat=Chat(id=10000, type=ChatType.PRIVATE, first_name="Alice"),
+        date=datetime.now(),
+        text="hello " * 40,
+    )
+    queue = []
+    for i in range(20):
+        op = BroadcastOperation(member=member, context=context, message=Message(id=i, group=group, member=member, mid=100 + i))
+        op.finished = None
+        queue.append(op)
+    return {
+        "worker status": {"time": 12345.6, "requests": 98765, "errors": 12},
+        "invite code": (1, 10),
+        "invite code (legacy member)": (member, 10),
+        "menu parameters": {"member_id": 1, "lga_sorting": ["members", True], "cursor_list_group_members": {"0": [40, 123]}},
+        "worker queue": queue,
+    }
+
+
+def bench(val, codec, rounds):
+    data = Codec.dumps(val, codec)
+    if data[1:2] != Codec.codecs[codec][0]:
+        return None
+    start = time.perf_counter()
+    for _ in range(rounds):
+        Codec.dumps(val, codec)
+    dumps = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        Codec.loads(data)
+    loads = (time.perf_counter() - start) / rounds
+    return len(data), dumps, loads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    print(f"{'payload':<28} {'codec':<8} {'bytes':>8} {'dumps (us)':>11} {'loads (us)':>11}")
+    for name, val in payloads().items():
+        for codec in Codec.codecs:
+            result = bench(val, codec, args.rounds)
+            if not result:
+                print(f"{name:<28} {codec:<8} {'(unsupported)':>8}")
+                continue
+            size, dumps, loads = result
+            print(f"{name:<28} {codec:<8} {size:>8} {dumps * 1e6:>11.1f} {loads * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
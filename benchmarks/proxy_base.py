@@ -0,0 +1,73 @@
+"""
+Compare attribute access through ProxyBase with the per-access MRO walk it used to do.
+
+Usage: python benchmarks/proxy_base.py [-n ROUNDS]
+"""
+
+import argparse
+import inspect
+import timeit
+
+from anonyabbot.utils import ProxyBase
+
+
+class DictProxy(ProxyBase):
+    __noproxy__ = ("_path", "_default")
+
+    def __init__(self, val):
+        self._path = "bench"
+        self.__subject__ = val
+
+
+class QueueProxy(DictProxy):
+    __noproxy__ = ("_bot",)
+
+
+def legacy_noproxy(self, oga=object.__getattribute__):
+    base = oga(self, "__class__")
+    for cls in inspect.getmro(base):
+        if hasattr(cls, "__noproxy__"):
+            yield from cls.__noproxy__
+
+
+def legacy_getattr(self, attr, oga=object.__getattribute__):
+    if attr == "hasattr" or self.hasattr(attr):
+        return oga(self, attr)
+    else:
+        return getattr(oga(self, "__subject__"), attr)
+
+
+class LegacyQueueProxy(QueueProxy):
+    """Collects the no-proxy names on every access and looks up missing attributes twice, as ProxyBase did before."""
+
+    __getattr__ = legacy_getattr
+
+
+# Set after class creation, since ProxyBase replaces _noproxy of subclasses when they are created.
+LegacyQueueProxy._noproxy = property(legacy_noproxy)
+
+
+CASES = {
+    "len(p)": lambda p: len(p),
+    "p[key]": lambda p: p["a"],
+    "key in p": lambda p: "a" in p,
+    "p.get(key)": lambda p: p.get("a"),
+    "p._path = val": lambda p: setattr(p, "_path", "bench"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--rounds", type=int, default=200000)
+    args = parser.parse_args()
+    proxies = {"legacy": LegacyQueueProxy({"a": 1}), "cached": QueueProxy({"a": 1})}
+    print(f"{'access':<16} {'legacy (ns)':>12} {'cached (ns)':>12} {'speed-up':>9}")
+    for name, case in CASES.items():
+        times = {}
+        for impl, p in proxies.items():
+            times[impl] = min(timeit.repeat(lambda: case(p), number=args.rounds, repeat=3)) / args.rounds
+        print(f"{name:<16} {times['legacy'] * 1e9:>12.0f} {times['cached'] * 1e9:>12.0f} {times['legacy'] / times['cached']:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+CREATE TABLE "bangroup" ("id" INTEGER NOT NULL PRIMARY KEY, "created" DATETIME NOT NULL, "until" DATETIME);
+CREATE TABLE "bangroupentry" ("id" INTEGER NOT NULL PRIMARY KEY, "type" INTEGER NOT NULL, "group_id" INTEGER NOT NULL, FOREIGN KEY ("group_id") REFERENCES "bangroup" ("id"));
+CREATE INDEX "bangroupentry_group_id" ON "bangroupentry" ("group_id");
+CREATE TABLE "user" ("id" INTEGER NOT NULL PRIMARY KEY, "uid" INTEGER NOT NULL, "username" VARCHAR(255), "firstname" VARCHAR(255), "lastname" VARCHAR(255), "created" DATETIME NOT NULL);
+CREATE UNIQUE INDEX "user_uid" ON "user" ("uid");
+CREATE INDEX "user_username" ON "user" ("username");
+CREATE INDEX "user_firstname" ON "user" ("firstname");
+CREATE INDEX "user_lastname" ON "user" ("lastname");
+CREATE TABLE "group" ("id" INTEGER NOT NULL PRIMARY KEY, "uid" INTEGER NOT NULL, "token" VARCHAR(50) NOT NULL, "username" VARCHAR(255) NOT NULL, "title" VARCHAR(255), "creator_id" INTEGER NOT NULL, "created" DATETIME NOT NULL, "last_activity" DATETIME NOT NULL, "default_ban_group_id" INTEGER NOT NULL, "welcome_message" TEXT, "welcome_message_photo" TEXT, "welcome_message_buttons" TEXT, "welcome_latest_messages" INTEGER NOT NULL, "chat_instruction" TEXT, "parent_id" INTEGER, "password" TEXT, "inactive_leave" INTEGER NOT NULL, "private" INTEGER NOT NULL, "disabled" INTEGER NOT NULL, FOREIGN KEY ("creator_id") REFERENCES "user" ("id"), FOREIGN KEY ("default_ban_group_id") REFERENCES "bangroup" ("id"), FOREIGN KEY ("parent_id") REFERENCES "group" ("id"));
+CREATE INDEX "group_uid" ON "group" ("uid");
+CREATE UNIQUE INDEX "group_token" ON "group" ("token");
+CREATE INDEX "group_username" ON "group" ("username");
+CREATE INDEX "group_title" ON "group" ("title");
+CREATE INDEX "group_creator_id" ON "group" ("creator_id");
+CREATE INDEX "group_default_ban_group_id" ON "group" ("default_ban_group_id");
+CREATE INDEX "group_parent_id" ON "group" ("parent_id");
+CREATE TABLE "member" ("id" INTEGER NOT NULL PRIMARY KEY, "group_id" INTEGER NOT NULL, "user_id" INTEGER NOT NULL, "role" INTEGER NOT NULL, "created" DATETIME NOT NULL, "last_activity" DATETIME NOT NULL, "last_mask" VARCHAR(255), "pinned_mask" VARCHAR(255), "invitor_id" INTEGER, "ban_group_id" INTEGER, FOREIGN KEY ("group_id") REFERENCES "group" ("id"), FOREIGN KEY ("user_id") REFERENCES "user" ("id"), FOREIGN KEY ("invitor_id") REFERENCES "member" ("id"), FOREIGN KEY ("ban_group_id") REFERENCES "bangroup" ("id"));
+CREATE INDEX "member_group_id" ON "member" ("group_id");
+CREATE INDEX "member_user_id" ON "member" ("user_id");
+CREATE INDEX "member_invitor_id" ON "member" ("invitor_id");
+CREATE INDEX "member_ban_group_id" ON "member" ("ban_group_id");
+CREATE TABLE "message" ("id" INTEGER NOT NULL PRIMARY KEY, "group_id" INTEGER NOT NULL, "mid" INTEGER NOT NULL, "member_id" INTEGER NOT NULL, "mask" VARCHAR(255) NOT NULL, "reply_to_id" INTEGER, "pinned" INTEGER NOT NULL, "updated" DATETIME NOT NULL, "created" DATETIME NOT NULL, FOREIGN KEY ("group_id") REFERENCES "group" ("id"), FOREIGN KEY ("member_id") REFERENCES "member" ("id"), FOREIGN KEY ("reply_to_id") REFERENCES "message" ("id"));
+CREATE INDEX "message_group_id" ON "message" ("group_id");
+CREATE INDEX "message_mid" ON "message" ("mid");
+CREATE INDEX "message_member_id" ON "message" ("member_id");
+CREATE INDEX "message_reply_to_id" ON "message" ("reply_to_id");
+CREATE TABLE "pmban" ("id" INTEGER NOT NULL PRIMARY KEY, "from_member_id" INTEGER, "to_member_id" INTEGER NOT NULL, "created" DATETIME NOT NULL, FOREIGN KEY ("from_member_id") REFERENCES "member" ("id"), FOREIGN KEY ("to_member_id") REFERENCES "member" ("id"));
+CREATE INDEX "pmban_from_member_id" ON "pmban" ("from_member_id");
+CREATE INDEX "pmban_to_member_id" ON "pmban" ("to_member_id");
+CREATE TABLE "pmmessage" ("id" INTEGER NOT NULL PRIMARY KEY, "from_member_id" INTEGER, "to_member_id" INTEGER NOT NULL, "mid" INTEGER NOT NULL, "redirected_mid" INTEGER NOT NULL, "time" DATETIME NOT NULL, FOREIGN KEY ("from_member_id") REFERENCES "member" ("id"), FOREIGN KEY ("to_member_id") REFERENCES "member" ("id"));
+CREATE INDEX "pmmessage_from_member_id" ON "pmmessage" ("from_member_id");
+CREATE INDEX "pmmessage_to_member_id" ON "pmmessage" ("to_member_id");
+CREATE INDEX "pmmessage_mid" ON "pmmessage" ("mid");
+CREATE INDEX "pmmessage_redirected_mid" ON "pmmessage" ("redirected_mid");
+CREATE TABLE "redirectedmessage" ("id" INTEGER NOT NULL PRIMARY KEY, "mid" INTEGER NOT NULL, "message_id" INTEGER NOT NULL, "to_member_id" INTEGER NOT NULL, "created" DATETIME NOT NULL, FOREIGN KEY ("message_id") REFERENCES "message" ("id"), FOREIGN KEY ("to_member_id") REFERENCES "member" ("id"));
+CREATE INDEX "redirectedmessage_mid" ON "redirectedmessage" ("mid");
+CREATE INDEX "redirectedmessage_message_id" ON "redirectedmessage" ("message_id");
+CREATE INDEX "redirectedmessage_to_member_id" ON "redirectedmessage" ("to_member_id");
+CREATE TABLE "validation" ("id" INTEGER NOT NULL PRIMARY KEY, "user_id" INTEGER NOT NULL, "role" INTEGER NOT NULL, "until" DATETIME, "created" DATETIME NOT NULL, FOREIGN KEY ("user_id") REFERENCES "user" ("id"));
+CREATE INDEX "validation_user_id" ON "validation" ("user_id");
+CREATE TABLE "validationrequest" ("id" INTEGER NOT NULL PRIMARY KEY, "code" VARCHAR(255), "role" INTEGER NOT NULL, "days" INTEGER, "created" DATETIME NOT NULL, "created_by_id" INTEGER NOT NULL, "used_id" INTEGER, FOREIGN KEY ("created_by_id") REFERENCES "user" ("id"), FOREIGN KEY ("used_id") REFERENCES "validation" ("id"));
+CREATE INDEX "validationrequest_created_by_id" ON "validationrequest" ("created_by_id");
+CREATE INDEX "validationrequest_used_id" ON "validationrequest" ("used_id");
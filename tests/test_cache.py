@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from anonyabbot.cache import AsyncCache, AsyncCacheDict, Cache, CacheHash
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    Cache.source = None
+    Cache.refresh()
+    yield
+    Cache.source = None
+
+
+def test_hash_fields():
+    async def main():
+        h = CacheHash("test.hash")
+        await h.set("a", {"x": 1})
+        await h.update({"b": [2], "c": "z"})
+        assert await h.get("a") == {"x": 1}
+        assert await h.length() == 3
+        assert await h.delete("b") == 1
+        assert not await h.contains("b")
+        assert await h.get("b", None) is None
+        with pytest.raises(KeyError):
+            await h.get("b")
+        assert await h.items() == {"a": {"x": 1}, "c": "z"}
+
+    asyncio.run(main())
+
+
+def test_set_many():
+    async def main():
+        await AsyncCache("test.many").set_many({"a": 1, "b": [2]})
+        Cache.local.clear()
+        assert Cache("test.many").get("a") == 1
+        assert await AsyncCache("test.many").get("b") == [2]
+
+    asyncio.run(main())
+
+
+def test_async_dict():
+    async def main():
+        d = AsyncCacheDict("test.dict", default={})
+        with pytest.raises(RuntimeError):
+            d["a"] = 1
+        await d.reload()
+        d["a"] = 1
+        await d.save()
+        other = AsyncCacheDict("test.dict")
+        await other.reload()
+        assert other["a"] == 1
+        await AsyncCache("test.dict").set(val={"a": 2})
+        other.invalidate()
+        await other.reload(force=False)
+        assert other["a"] == 2
+
+    asyncio.run(main())
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import pytest
+
+from anonyabbot.migration import check_query_plans, migrations, upgrade
+from anonyabbot.model import db
+
+
+@pytest.fixture
+def database():
+    db.init(":memory:")
+    yield db
+    db.close()
+
+
+def test_fresh_database_uses_indexes(database):
+    upgrade()
+    assert check_query_plans() == []
+
+
+def test_upgraded_database_uses_indexes(database):
+    """A database created by the version before migrations gets the indexes of hot queries."""
+    for statement in (Path(__file__).parent / "baseline_schema.sql").read_text().split(";"):
+        if statement.strip():
+            database.execute_sql(statement)
+    assert database.pragma("user_version") == 0
+    upgrade()
+    assert database.pragma("user_version") == len(migrations)
+    assert check_query_plans() == []
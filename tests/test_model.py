@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import pytest
+from playhouse.test_utils import count_queries
+
+from anonyabbot.cache import Cache
+from anonyabbot.migration import upgrade
+from anonyabbot.model import db, ArchivedMessage, BanGroup, BanType, CompiledBans, Group, Member, MemberRole, Message, User
+
+
+@pytest.fixture
+def database():
+    db.init(":memory:")
+    upgrade()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def member(database):
+    user = User.create(uid=10000, firstname="Alice")
+    group = Group.create(uid=20000, token="0:token", username="group", creator=user, default_ban_group=BanGroup.generate())
+    return Member.create(group=group, user=user, role=MemberRole.MEMBER)
+
+
+def statements(counter):
+    """Queries run, without transaction control statements."""
+    control = ("BEGIN", "SAVEPOINT", "RELEASE", "COMMIT", "ROLLBACK")
+    return [q.msg[0] for q in counter.get_queries() if not q.msg[0].lstrip().upper().startswith(control)]
+
+
+def test_member_touch_only_updates(member):
+    with count_queries() as counter:
+        member.touch()
+    assert [q.split()[0] for q in statements(counter)] == ["UPDATE"]
+
+
+def test_group_touch_only_updates(member):
+    group = member.group
+    with count_queries() as counter:
+        group.touch()
+    assert [q.split()[0] for q in statements(counter)] == ["UPDATE"]
+
+
+def test_role_change_reads_old_role(member):
+    member.role = MemberRole.ADMIN
+    with count_queries() as counter:
+        member.save()
+    assert any(q.startswith("SELECT") for q in statements(counter))
+
+
+def test_avg_n_members_is_one_query(member):
+    group = member.group
+    user = User.create(uid=10001)
+    other = Group.create(uid=20001, token="1:token", username="other", creator=user, default_ban_group=BanGroup.generate())
+    for i in range(3):
+        Member.create(group=other, user=User.create(uid=10010 + i), role=MemberRole.MEMBER)
+    assert Group.get_avg_n_members() == 2
+    with count_queries() as counter:
+        assert Group.get_avg_n_members() == 2
+    assert len(statements(counter)) == 2
+    Member.create(group=group, user=User.create(uid=10020), role=MemberRole.MEMBER)
+    assert Group.get_avg_n_members() == 2.5
+
+
+def test_active_groups_counter(member):
+    group = member.group
+    assert Group.n_active_groups() == 1
+    group.disabled = True
+    group.save()
+    assert Group.n_active_groups() == 0
+    group.disabled = False
+    group.last_activity = datetime.now() - timedelta(days=30)
+    group.save()
+    assert Group.n_active_groups() == 0
+    group.touch()
+    with count_queries() as counter:
+        assert Group.n_active_groups() == 1
+    assert len(statements(counter)) == 1
+
+
+def test_archive_bounds_redirects(member):
+    group = member.group
+    receivers = [Member.create(group=group, user=User.create(uid=10100 + i), role=MemberRole.MEMBER) for i in range(5)]
+    old = datetime.now() - timedelta(days=60)
+    messages = [Message.create(group=group, member=member, mid=i, mask="m", created=old) for i in range(4)]
+    for m in messages:
+        m.add_redirects([(r, m.mid * 100 + i) for i, r in enumerate(receivers)])
+    before = datetime.now() - timedelta(days=30)
+    assert ArchivedMessage.archive(group, before, max_redirects=8) == 1
+    assert ArchivedMessage.archive(group, before, max_redirects=10) == 2
+    assert ArchivedMessage.archive(group, before) == 1
+    assert ArchivedMessage.archive(group, before) == 0
+    archived = [m for a in ArchivedMessage.select().order_by(ArchivedMessage.id) for m in a.load()["messages"]]
+    assert [m["mid"] for m in archived] == [0, 1, 2, 3]
+    assert dict(archived[1]["redirects"]) == {r.id: 100 + i for i, r in enumerate(receivers)}
+
+
+def test_not_redirected_pinned_messages_bounded(member):
+    group = member.group
+    sender = Member.create(group=group, user=User.create(uid=10200), role=MemberRole.MEMBER)
+    for i in range(15):
+        Message.create(group=group, member=sender, mid=i, mask="m", pinned=True)
+    Message.create(group=group, member=sender, mid=100, mask="m", pinned=True, created=datetime.now() - timedelta(days=60))
+    pinned = member.not_redirected_pinned_messages()
+    assert [m.mid for m in pinned] == list(range(14, 4, -1))
+    assert len(member.not_redirected_pinned_messages(limit=100)) == 15
+    assert len(member.not_redirected_pinned_messages(limit=100, days=90)) == 16
+
+
+def test_ban_changes_reach_other_processes(member, monkeypatch):
+    client = Cache.client()
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(Cache.channel)
+    monkeypatch.setattr(Cache, "pubsub", pubsub)
+    group = BanGroup.generate([BanType.MEDIA])
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(3)]
+    assert [m["data"] for m in messages if m] == [f"{Cache.origin}:{CompiledBans.path}".encode()]
+
+    assert BanGroup.compiled(group.id)[0] == BanGroup.bit(BanType.MEDIA)
+    Cache.on_invalidate({"data": f"other:{CompiledBans.path}".encode()})
+    assert group.id not in BanGroup._compiled